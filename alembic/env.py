@@ -1,6 +1,8 @@
 from __future__ import with_statement
+import os
+import sys
+
 from alembic import context
-from sqlalchemy import engine_from_config, pool
 from logging.config import fileConfig
 
 # this is the Alembic Config object, which provides
@@ -11,6 +13,16 @@ config = context.config
 # This line sets up loggers basically.
 fileConfig(config.config_file_name)
 
+# migrations run against the database of the RUN_MODE config, through the
+# engine the application uses
+os.environ.setdefault('RUN_MODE', 'DEV')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import load_config  # noqa: E402
+from common.database import configure, get_engine  # noqa: E402
+
+configure(load_config())
+engine = get_engine()
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
@@ -35,9 +47,8 @@ def run_migrations_offline():
     script output.
 
     """
-    url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True)
+        url=engine.url, target_metadata=target_metadata, literal_binds=True)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -50,12 +61,10 @@ def run_migrations_online():
     and associate a connection with the context.
 
     """
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix='sqlalchemy.',
-        poolclass=pool.NullPool)
-
-    with connectable.connect() as connection:
+    with engine.connect() as connection:
+        # index builds and data migrations may run for longer than the
+        # statement timeout of the application
+        connection.execute('SET statement_timeout = 0')
         context.configure(
             connection=connection,
             target_metadata=target_metadata
@@ -0,0 +1,38 @@
+"""labels name unique
+
+Revision ID: 2a9d5e81f4b7
+Revises: c7f19b2d4e08
+Create Date: 2026-10-18 14:41:17.203845
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2a9d5e81f4b7'
+down_revision = 'c7f19b2d4e08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # labels used to be created without checking existing names, keep the
+    # oldest label of every name and move references over to it
+    op.execute("""
+        UPDATE labels_events SET label_id = duplicates.keep_id
+        FROM (
+            SELECT id, min(id) OVER (PARTITION BY name) AS keep_id
+            FROM labels
+        ) AS duplicates
+        WHERE labels_events.label_id = duplicates.id
+          AND duplicates.id <> duplicates.keep_id
+    """)
+    op.execute("""
+        DELETE FROM labels USING labels AS kept
+        WHERE labels.name = kept.name AND labels.id > kept.id
+    """)
+    op.create_index('ix_labels_name', 'labels', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_labels_name', table_name='labels')
@@ -0,0 +1,38 @@
+"""updated_at and version of events and users
+
+Revision ID: 4f8c2d7a1b93
+Revises: 2a9d5e81f4b7
+Create Date: 2026-10-18 16:12:40.531207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8c2d7a1b93'
+down_revision = '2a9d5e81f4b7'
+branch_labels = None
+depends_on = None
+
+TABLES = ('events', 'users')
+
+
+def upgrade():
+    # constant defaults, existing rows are not rewritten
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at',
+                                       sa.DateTime(timezone=True),
+                                       server_default=sa.func.now(),
+                                       nullable=False))
+        op.add_column(table, sa.Column('version', sa.Integer(),
+                                       server_default='1', nullable=False))
+    op.create_index('ix_events_user_id_updated_at_version', 'events',
+                    ['user_id', 'updated_at', 'version'])
+
+
+def downgrade():
+    op.drop_index('ix_events_user_id_updated_at_version', table_name='events')
+    for table in TABLES:
+        op.drop_column(table, 'version')
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,41 @@
+"""event span index
+
+Revision ID: 5b2e6f3c9a1d
+Revises: 034a611d5a31
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e6f3c9a1d'
+down_revision = '034a611d5a31'
+branch_labels = None
+depends_on = None
+
+TIMESTAMP_COLUMNS = ('start', 'end', 'next_notification')
+
+
+def upgrade():
+    # tstzrange() over plain timestamps is not immutable, so the columns
+    # have to match the model (timezone aware) before they can be indexed
+    for column in TIMESTAMP_COLUMNS:
+        op.alter_column('events', column,
+                        type_=sa.DateTime(timezone=True),
+                        postgresql_using='"{}" AT TIME ZONE \'UTC\''
+                        .format(column))
+
+    op.execute('CREATE INDEX ix_events_span ON events '
+               'USING gist (tstzrange(start, "end", \'[]\'))')
+
+
+def downgrade():
+    op.drop_index('ix_events_span', table_name='events')
+
+    for column in TIMESTAMP_COLUMNS:
+        op.alter_column('events', column,
+                        type_=sa.DateTime(),
+                        postgresql_using='"{}" AT TIME ZONE \'UTC\''
+                        .format(column))
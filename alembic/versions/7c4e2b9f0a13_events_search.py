@@ -0,0 +1,31 @@
+"""events search
+
+Revision ID: 7c4e2b9f0a13
+Revises: 9e3b71c5d2a6
+Create Date: 2026-10-18 18:20:47.630519
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4e2b9f0a13'
+down_revision = '9e3b71c5d2a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # fills the column of every existing row, under an exclusive lock
+    op.execute("""
+        ALTER TABLE events ADD COLUMN search tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(description, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(place, '')), 'B')
+        ) STORED
+    """)
+    op.execute('CREATE INDEX ix_events_search ON events USING gin (search)')
+
+
+def downgrade():
+    op.drop_index('ix_events_search', table_name='events')
+    op.drop_column('events', 'search')
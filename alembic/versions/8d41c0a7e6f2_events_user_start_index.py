@@ -0,0 +1,24 @@
+"""events user start index
+
+Revision ID: 8d41c0a7e6f2
+Revises: 5b2e6f3c9a1d
+Create Date: 2026-10-18 11:03:54.118640
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41c0a7e6f2'
+down_revision = '5b2e6f3c9a1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_events_user_id_start_id', 'events',
+                    ['user_id', 'start', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_events_user_id_start_id', table_name='events')
@@ -0,0 +1,24 @@
+"""events status end index
+
+Revision ID: 9e3b71c5d2a6
+Revises: 4f8c2d7a1b93
+Create Date: 2026-10-18 17:42:31.204118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3b71c5d2a6'
+down_revision = '4f8c2d7a1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_events_status_id_end', 'events',
+                    ['status_id', 'end'])
+
+
+def downgrade():
+    op.drop_index('ix_events_status_id_end', table_name='events')
@@ -0,0 +1,26 @@
+"""events next notification index
+
+Revision ID: c7f19b2d4e08
+Revises: 8d41c0a7e6f2
+Create Date: 2026-10-18 13:27:09.551382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f19b2d4e08'
+down_revision = '8d41c0a7e6f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_events_next_notification', 'events',
+                    ['next_notification'],
+                    postgresql_where=sa.text('next_notification IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_events_next_notification', table_name='events')
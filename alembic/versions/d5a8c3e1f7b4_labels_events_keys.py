@@ -0,0 +1,43 @@
+"""labels events keys
+
+Revision ID: d5a8c3e1f7b4
+Revises: 7c4e2b9f0a13
+Create Date: 2026-10-18 19:05:12.418370
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c3e1f7b4'
+down_revision = '7c4e2b9f0a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # merging duplicate labels in 2a9d5e81f4b7 may have attached a label
+    # twice to an event, and rows missing either side are meaningless
+    op.execute("""
+        DELETE FROM labels_events
+        WHERE label_id IS NULL OR event_id IS NULL
+    """)
+    op.execute("""
+        DELETE FROM labels_events USING labels_events AS kept
+        WHERE labels_events.event_id = kept.event_id
+          AND labels_events.label_id = kept.label_id
+          AND labels_events.ctid > kept.ctid
+    """)
+    op.create_primary_key('labels_events_pkey', 'labels_events',
+                          ['event_id', 'label_id'])
+    op.create_index('ix_labels_events_label_id_event_id', 'labels_events',
+                    ['label_id', 'event_id'])
+
+
+def downgrade():
+    op.drop_index('ix_labels_events_label_id_event_id',
+                  table_name='labels_events')
+    op.drop_constraint('labels_events_pkey', 'labels_events',
+                       type_='primary')
+    op.alter_column('labels_events', 'event_id', nullable=True)
+    op.alter_column('labels_events', 'label_id', nullable=True)
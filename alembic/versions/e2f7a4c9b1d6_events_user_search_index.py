@@ -0,0 +1,31 @@
+"""events user search index
+
+Revision ID: e2f7a4c9b1d6
+Revises: d5a8c3e1f7b4
+Create Date: 2026-10-18 21:42:03.127904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f7a4c9b1d6'
+down_revision = 'd5a8c3e1f7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # searches are always by user, btree_gin lets the GIN index narrow
+    # them by user_id instead of ranking every match of every user.
+    # Creating the extension needs a superuser before PostgreSQL 13.
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    op.execute('CREATE INDEX ix_events_user_id_search ON events '
+               'USING gin (user_id, search)')
+    op.drop_index('ix_events_search', table_name='events')
+
+
+def downgrade():
+    # the extension is left in place, other objects may depend on it
+    op.execute('CREATE INDEX ix_events_search ON events USING gin (search)')
+    op.drop_index('ix_events_user_id_search', table_name='events')
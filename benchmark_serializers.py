@@ -0,0 +1,83 @@
+import argparse
+import json
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytz
+
+from common.json_encoding import dumps
+from common.models import User
+from events.models import Event, EventMedia, Label
+from events.serializers import EventSchema, dump_events
+from events.statuses import status_registry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compare EventSchema with the compiled event dump, '
+                    'and the json module with the response encoder.')
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    return parser.parse_args()
+
+
+def make_events(count):
+    user = User(username='bench', email='bench@example.com',
+                first_name='Bench', last_name='Mark')
+    labels = [Label(name='label{}'.format(i)) for i in range(5)]
+    start = datetime(2030, 1, 1, tzinfo=pytz.utc)
+    events = []
+    for i in range(count):
+        periodic = i % 2 == 0
+        event_start = start + timedelta(hours=i)
+        events.append(Event(
+            id=i, user=user, description='event {}'.format(i),
+            place='place {}'.format(i % 10),
+            start=event_start, end=event_start + timedelta(days=30),
+            periodic=periodic,
+            period=timedelta(days=1, hours=2) if periodic else None,
+            next_notification=event_start - timedelta(minutes=15),
+            status_id=1 + i % 2,
+            labels=labels[:i % 5], media=[EventMedia()] if i % 3 else []))
+    return events
+
+
+def best(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def stdlib_response_body(data):
+    # what flask_restful's output_json did
+    return (json.dumps(data) + '\n').encode('utf-8')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    status_registry.load([(1, 'W'), (2, 'P')])
+    events = make_events(args.events)
+
+    schema_time = best(lambda: EventSchema().dump(events, many=True),
+                       args.repeat)
+    compiled_time = best(lambda: dump_events(events), args.repeat)
+    print('{} events, best of {}'.format(args.events, args.repeat))
+    print('EventSchema:   {:.3f}s'.format(schema_time))
+    print('compiled dump: {:.3f}s'.format(compiled_time))
+    print('speedup:       {:.1f}x'.format(schema_time / compiled_time))
+
+    data = {'status': 'OK', 'code': 200, 'message': None,
+            'data': dump_events(events)}
+    for name, encode in (('json module', stdlib_response_body),
+                         ('encoder', dumps)):
+        print('{:<14} {:.3f}s, peak {:.1f} MiB'.format(
+            name + ':', best(lambda: encode(data), args.repeat),
+            peak_memory(lambda: encode(data)) / 2 ** 20))
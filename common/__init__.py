@@ -1,23 +1,59 @@
 import os
-import flask_login
 
-from flask import Flask
-from flask_restful import Api
-from flask_sqlalchemy import SQLAlchemy
-from flask_marshmallow import Marshmallow
+config_mapping = {
+    'CI': 'common.ci_config',
+    'DEV': 'common.config',
+    'TEST': 'common.test_config'
+}
+
+
+def config_from_env():
+    """Import path of the config module selected by ``RUN_MODE``."""
+    run_mode = os.environ.get('RUN_MODE')
+    if run_mode not in config_mapping:
+        raise Exception('Invalid run mode specified')
+    return config_mapping[run_mode]
+
+
+def load_config(config=None):
+    """``flask.Config`` filled from ``config``, an object or its import
+    path, by default the config module of ``RUN_MODE``."""
+    from flask import Config
+    loaded = Config(os.path.dirname(os.path.dirname(__file__)))
+    loaded.from_object(config or config_from_env())
+    return loaded
 
 
-def get_app(config):
+def create_app(config=None):
+    """Build the application for ``config``, see ``load_config``.
+
+    Nothing connects to the database here. The engine is created on first
+    use by the process using it, so the app can be built before a prefork
+    server forks its workers. ``APP_WARMUP`` runs ``warmup`` right away,
+    it belongs in the workers and not in a preloading master.
+    """
+    from flask import Flask
+    from flask_restful import Api
+
+    from . import database, datetimes, json_encoding
+    from .extensions import db, login_manager, ma
+
     app = Flask(__name__)
-    app.config.from_object(config)
+    app.config.update(load_config(config))
+    database.configure(app.config)
+    datetimes.configure(app.config)
 
-    db = SQLAlchemy(app)
-    login_manager = flask_login.LoginManager()
+    db.init_app(app)
     login_manager.init_app(app)
-    api = Api(app)
-    ma = Marshmallow(app)
+    json_encoding.register(Api(app))
+    ma.init_app(app)
+    register_blueprints(app)
+    register_instrumentation(app)
 
-    return app, db, api, ma
+    if app.config['APP_WARMUP']:
+        from .warmup import warmup
+        warmup(app)
+    return app
 
 
 def create_all(app, db):
@@ -27,26 +63,18 @@ def create_all(app, db):
 
 
 def register_blueprints(app):
-    # import is used to register /auth/ endpoint
     from . import jwt_functions
     from .views import app_bp as users_blueprint
     from .base import app_bp as base_bp
-    from events import blueprint as events_blueprint
+    import events
 
+    # registers the /auth/ endpoint
+    jwt_functions.init_app(app)
     app.register_blueprint(users_blueprint)
-    app.register_blueprint(events_blueprint)
+    events.init_app(app)
     app.register_blueprint(base_bp)
 
-config_mapping = {
-    'CI': 'common.ci_config',
-    'DEV': 'common.config',
-    'TEST': 'common.test_config'
-}
-
-run_mode = os.environ.get('RUN_MODE')
-if run_mode not in config_mapping:
-    raise Exception('Invalid run mode specified')
 
-config_file = config_mapping[run_mode]
-app, db, api, ma = get_app(config_file)
-register_blueprints(app)
+def register_instrumentation(app):
+    from .sqlstats import instrument
+    instrument(app)
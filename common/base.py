@@ -1,12 +1,20 @@
-from flask import Blueprint
+from flask import Blueprint, current_app, jsonify
 from flask_jwt import JWTError
 from flask_restful import Resource, abort
 
+from common import metrics
 from common.utils import ResponseCodes, template_response
 
 app_bp = Blueprint('base', __name__)
 
 
+@app_bp.route('/metrics/')
+def metrics_view():
+    if not current_app.config['EXPOSE_METRICS']:
+        abort(ResponseCodes.NOT_FOUND_404)
+    return jsonify(metrics.snapshot())
+
+
 class BaseResource(Resource):
 
     def dispatch_request(self, *args, **kwargs):
@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """Thread safe mapping keeping at most ``maxsize`` most recently used
+    entries. With ``ttl`` set, entries older than ``ttl`` seconds are
+    treated as missing. With ``weigh`` set, ``maxsize`` bounds the sum of
+    ``weigh(value)`` over entries instead of their number, and a value
+    weighing more than ``maxsize`` is not stored."""
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic,
+                 weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._weigh = weigh or (lambda value: 1)
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def configure(self, maxsize, ttl=None):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._evict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        expires, value, weight = self._data.pop(key)
+        self.weight -= weight
+        return value
+
+    def _evict(self):
+        while self.weight > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value, weight = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self._clock():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = self._clock() + self.ttl if self.ttl else None
+        weight = self._weigh(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if weight > self.maxsize:
+                return
+            self._data[key] = expires, value, weight
+            self.weight += weight
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            weight=self.weight,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=round(self.hits / lookups, 4) if lookups else None
+        )
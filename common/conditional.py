@@ -0,0 +1,36 @@
+import hashlib
+
+import pytz
+from flask import Response, request
+from werkzeug.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Weak entity tag of a representation identified by ``parts``."""
+    digest = hashlib.sha1('|'.join(map(str, parts)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """Whether the conditional headers of the request match ``etag`` and
+    ``last_modified``. As RFC 7232 asks, ``If-Modified-Since`` is ignored
+    when ``If-None-Match`` is sent."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have a resolution of one second
+        return last_modified.astimezone(pytz.utc)\
+            .replace(tzinfo=None, microsecond=0) <= request.if_modified_since
+    return False
+
+
+def validator_headers(etag, last_modified=None):
+    headers = {'ETag': quote_etag(etag, weak=True)}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag, last_modified=None):
+    return Response(status=304,
+                    headers=validator_headers(etag, last_modified))
@@ -1,25 +1,100 @@
-from sqlalchemy import Column, Integer
+import os
+import threading
+
+from sqlalchemy import Column, Integer, event
 from sqlalchemy.engine import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.scoping import scoped_session
-from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy.orm.session import Session, sessionmaker
+
+from common import metrics
+from common.pool import InstrumentedQueuePool, ping
+
+_lock = threading.Lock()
+_config = None
+_engine = None
+_engine_pid = None
+# Engines inherited through fork(). Their connections belong to the parent
+# process: using them would mix up both processes' sessions and closing
+# them would end the parent's sessions, so they are only kept referenced.
+_inherited_engines = []
+
+
+def engine_from_config(config):
+    """Create the engine shared by ``db_session``, Flask-SQLAlchemy and
+    alembic from the ``SQLALCHEMY_*`` settings of ``config``."""
+    connect_args = {}
+    if config.get('SQLALCHEMY_STATEMENT_TIMEOUT'):
+        connect_args['options'] = '-c statement_timeout={:d}'.format(
+            config['SQLALCHEMY_STATEMENT_TIMEOUT'])
+
+    engine = create_engine(config['SQLALCHEMY_DATABASE_URI'],
+                           convert_unicode=True,
+                           echo=config.get('SQLALCHEMY_ECHO', False),
+                           poolclass=InstrumentedQueuePool,
+                           pool_size=config['SQLALCHEMY_POOL_SIZE'],
+                           max_overflow=config['SQLALCHEMY_MAX_OVERFLOW'],
+                           pool_timeout=config['SQLALCHEMY_POOL_TIMEOUT'],
+                           pool_recycle=config['SQLALCHEMY_POOL_RECYCLE'],
+                           connect_args=connect_args)
+    if config.get('SQLALCHEMY_POOL_PRE_PING'):
+        event.listen(engine.pool, 'checkout', ping)
+    return engine
+
+
+def configure(config):
+    """Have ``get_engine`` create the engine from ``config``."""
+    global _config, _engine, _engine_pid
+    with _lock:
+        if _engine is not None and _engine_pid == os.getpid():
+            _engine.dispose()
+        _config, _engine, _engine_pid = config, None, None
+
+
+def get_engine():
+    """Engine of the current process, created on first use. A process
+    forked after that gets an engine and a pool of its own."""
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _lock:
+            if _engine is None or _engine_pid != pid:
+                if _config is None:
+                    raise RuntimeError('The database is not configured, '
+                                       'create the app first')
+                if _engine is not None:
+                    _inherited_engines.append(_engine)
+                _engine = engine_from_config(_config)
+                _engine_pid = pid
+    return _engine
+
+
+def pool_stats():
+    # a disposed engine recreates its pool, so it is looked up every time
+    if _engine is None or _engine_pid != os.getpid():
+        return None
+    return _engine.pool.stats()
+
+
+metrics.register('db_pool', pool_stats)
 
-from common import app
 
+class EngineSession(Session):
+    """Session bound to the engine of the current process."""
 
-engine = create_engine(app.config.get('SQLALCHEMY_DATABASE_URI'),
-                       convert_unicode=True)
+    def get_bind(self, mapper=None, clause=None):
+        return get_engine()
 
 
 db_session = scoped_session(
     sessionmaker(
+        class_=EngineSession,
         autocommit=False,
         autoflush=False,
-        bind=engine,
         expire_on_commit=False)
 )
 
-decl_base = declarative_base(bind=engine)
+decl_base = declarative_base()
 decl_base.query = db_session.query_property()
 
 
@@ -0,0 +1,32 @@
+from marshmallow import fields
+
+
+class _Settings(object):
+    # DATETIME_FORMAT of the app, see configure
+    datetime_format = '%Y-%m-%d %H:%M:%S %z'
+
+
+settings = _Settings()
+
+
+def configure(config):
+    """Use the ``DATETIME_FORMAT`` of ``config`` for every datetime read or
+    written by the API, called by ``create_app``."""
+    settings.datetime_format = config['DATETIME_FORMAT']
+
+
+def format_datetime(value):
+    return value.strftime(settings.datetime_format)
+
+
+class DateTime(fields.DateTime):
+    """``DateTime`` field in the configured ``DATETIME_FORMAT``, read when
+    values are loaded or dumped rather than when schemas are declared."""
+
+    @property
+    def dateformat(self):
+        return settings.datetime_format
+
+    @dateformat.setter
+    def dateformat(self, value):
+        pass
@@ -0,0 +1,17 @@
+import flask_login
+from flask_marshmallow import Marshmallow
+from flask_sqlalchemy import SQLAlchemy
+
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy running on the engine of ``common.database``
+    instead of creating a second pool of its own."""
+
+    def get_engine(self, app=None, bind=None):
+        from .database import get_engine
+        return get_engine()
+
+
+db = SharedEngineSQLAlchemy()
+login_manager = flask_login.LoginManager()
+ma = Marshmallow()
@@ -0,0 +1,74 @@
+from operator import attrgetter
+
+from marshmallow import fields
+from marshmallow.utils import missing
+
+from . import datetimes
+
+
+def _text(value):
+    if value is None or type(value) is str:
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _field_dumper(schema, name, field):
+    """Function of an object returning what ``field`` dumps for it, or
+    ``missing`` when the key is left out of the output."""
+    attribute = field.attribute or name
+    if isinstance(field, fields.Method):
+        return getattr(schema, field.serialize_method_name)
+    if '.' in attribute:
+        return lambda obj: field.serialize(name, obj)
+
+    get = attrgetter(attribute)
+    field_type = type(field)
+    if field_type is fields.Integer and not field.as_string:
+        return lambda obj: _none_or(get(obj), int)
+    if field_type is fields.String:
+        return lambda obj: _text(get(obj))
+    if field_type is datetimes.DateTime:
+        return lambda obj: _none_or(get(obj), datetimes.format_datetime)
+    if field_type is fields.DateTime and field.dateformat and \
+            field.dateformat not in field.DATEFORMAT_SERIALIZATION_FUNCS:
+        dateformat = field.dateformat
+        return lambda obj: _none_or(get(obj),
+                                    lambda value: value.strftime(dateformat))
+    if field_type is fields.Nested:
+        dump = compile_dump(field.schema)
+        if field.many:
+            return lambda obj: _none_or(get(obj), lambda items: [
+                dump(item) for item in items])
+        return lambda obj: _none_or(get(obj), dump)
+    # any other field skips its public wrapper but runs its own code
+    serialize = field._serialize
+    return lambda obj: serialize(get(obj), name, obj)
+
+
+def _none_or(value, convert):
+    return None if value is None else convert(value)
+
+
+def compile_dump(schema):
+    """Return a function dumping one object like ``schema.dump(obj).data``.
+
+    The fields of ``schema`` are resolved once. Common field types are
+    replaced by plain functions, so no field object is walked per dumped
+    object. Objects are expected to have every dumped attribute, as model
+    instances do. Missing attributes and validation errors are not
+    handled.
+    """
+    dumpers = [(field.dump_to or name, _field_dumper(schema, name, field))
+               for name, field in schema.fields.items()
+               if not field.load_only]
+
+    def dump(obj):
+        data = {}
+        for key, dumper in dumpers:
+            value = dumper(obj)
+            if value is not missing:
+                data[key] = value
+        return data
+    return dump
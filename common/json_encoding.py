@@ -0,0 +1,66 @@
+import json
+from datetime import datetime, timedelta
+
+from flask import make_response
+
+from .datetimes import format_datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PreEncoded(bytes):
+    """JSON text already encoded, written to responses as it is."""
+
+
+def default(value):
+    """Encode values the encoder does not know, datetimes and timedeltas
+    are written the way the schemas dump them."""
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, timedelta):
+        minutes, seconds = divmod(value.seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return '{d} {h}:{m}:{s}'.format(d=value.days, h=hours, m=minutes,
+                                        s=seconds)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+_encoder = json.JSONEncoder(default=default, ensure_ascii=False,
+                            separators=(',', ':'))
+
+
+def stdlib_dumps(data):
+    return _encoder.encode(data).encode('utf-8')
+
+
+def stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def orjson_dumps(data):
+        return orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+
+    # orjson encodes straight to bytes, several times faster than json
+    dumps, loads = orjson_dumps, orjson.loads
+else:
+    dumps, loads = stdlib_dumps, stdlib_loads
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation of ``application/json``."""
+    body = data if isinstance(data, PreEncoded) else dumps(data)
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def register(api):
+    api.representation('application/json')(output_json)
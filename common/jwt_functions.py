@@ -1,10 +1,23 @@
-from common import app
-from flask import jsonify
+from collections import namedtuple
+
+from common import metrics, warmup
+from flask import current_app, jsonify
 from flask_jwt import JWT
+from sqlalchemy import event
 from werkzeug.security import safe_str_cmp
 
+from .cache import LRUCache
+from .database import db_session
 from .models import User
 
+# detached snapshot of a user, safe to share between requests
+Identity = namedtuple('Identity', [
+    'id', 'username', 'email', 'first_name', 'last_name'
+])
+
+identity_cache = LRUCache()
+metrics.register('jwt_identity_cache', identity_cache.stats)
+
 
 def auth_response_handler(access_token, identity):
     return jsonify({'token': access_token.decode('utf-8')})
@@ -17,10 +30,44 @@ def authenticate(username, password):
         return user
 
 
+def load_identity_query(user_id):
+    return db_session.query(*(getattr(User, field)
+                              for field in Identity._fields))\
+        .filter(User.id == user_id)
+
+
+def load_identity(user_id):
+    row = load_identity_query(user_id).first()
+    return row and Identity(*row)
+
+
 def identity(payload):
     user_id = payload['identity']
-    return User.query.get(user_id)
+    if not current_app.config['JWT_IDENTITY_CACHE']:
+        return load_identity(user_id)
 
+    user = identity_cache.get(user_id)
+    if user is None:
+        user = load_identity(user_id)
+        if user is not None:
+            identity_cache.set(user_id, user)
+    return user
 
-jwt = JWT(app, authenticate, identity)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_identity(mapper, connection, target):
+    identity_cache.pop(target.id)
+
+
+jwt = JWT(authentication_handler=authenticate, identity_handler=identity)
 jwt.auth_response_handler(auth_response_handler)
+
+
+warmup.register_statements(lambda: [load_identity_query(0).statement])
+
+
+def init_app(app):
+    identity_cache.configure(maxsize=app.config['JWT_IDENTITY_CACHE_SIZE'],
+                             ttl=app.config['JWT_IDENTITY_CACHE_TTL'])
+    jwt.init_app(app)
@@ -0,0 +1,10 @@
+_providers = {}
+
+
+def register(name, provider):
+    """Publish the dict returned by ``provider()`` under ``name``."""
+    _providers[name] = provider
+
+
+def snapshot():
+    return {name: provider() for name, provider in _providers.items()}
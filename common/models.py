@@ -1,8 +1,8 @@
 from flask_login import UserMixin
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import make_transient_to_detached, relationship
 
-from .database import Base
-from sqlalchemy import Column, String
+from .database import Base, db_session
+from sqlalchemy import Column, DateTime, Integer, String, func, text
 
 
 class User(Base, UserMixin):
@@ -13,6 +13,10 @@ class User(Base, UserMixin):
     first_name = Column(String(50))
     last_name = Column(String(100))
     password = Column(String(50))
+    updated_at = Column(DateTime(timezone=True), nullable=False,
+                        server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, server_default='1',
+                     onupdate=text('version + 1'))
     events = relationship('Event', backref='user', lazy='dynamic')
 
     def __repr__(self):
@@ -22,6 +26,18 @@ class User(Base, UserMixin):
                     first_name=self.first_name,
                     last_name=self.last_name)
 
+    @classmethod
+    def from_identity(cls, identity):
+        """Return the user described by a JWT identity attached to the
+        session without selecting it."""
+        user = cls(id=identity.id,
+                   username=identity.username,
+                   email=identity.email,
+                   first_name=identity.first_name,
+                   last_name=identity.last_name)
+        make_transient_to_detached(user)
+        return db_session.merge(user, load=False)
+
     def to_json(self):
         return dict(
             id=self.id,
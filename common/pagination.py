@@ -0,0 +1,38 @@
+import base64
+import json
+
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return str(base64.urlsafe_b64encode(payload), encoding='utf-8')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(str(base64.urlsafe_b64decode(cursor),
+                                encoding='utf-8'))
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(e)
+    if not isinstance(values, list):
+        raise InvalidCursor('Cursor should hold a list of key values')
+    return values
+
+
+def keyset_page(query, key_columns, limit, after=None):
+    """Return up to ``limit`` rows ordered by ``key_columns`` and a flag
+    telling whether more rows follow.
+
+    ``after`` holds key values of the last row of the previous page. Rows
+    are filtered with a row comparison instead of OFFSET, so any page costs
+    one index range scan.
+    """
+    if after is not None:
+        query = query.filter(tuple_(*key_columns) > tuple_(*after))
+    rows = query.order_by(*key_columns).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
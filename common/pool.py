@@ -0,0 +1,70 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """``QueuePool`` that records how long checkouts wait for a connection.
+
+    Together with the occupancy reported by ``stats`` this tells whether
+    ``pool_size`` and ``max_overflow`` fit the load of a worker.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(
+                size=self.size(),
+                max_overflow=self._max_overflow,
+                checked_out=self.checkedout(),
+                checked_in=self.checkedin(),
+                overflow=max(self.overflow(), 0),
+                checkouts=self.checkouts,
+                timeouts=self.timeouts,
+                wait_avg=round(self.wait_total / self.checkouts, 6)
+                if self.checkouts else None,
+                wait_max=round(self.wait_max, 6)
+            )
+
+
+def ping(dbapi_connection, connection_record, connection_proxy):
+    """Pool ``checkout`` listener testing a connection before handing it
+    out. A dead connection is replaced instead of failing the request.
+
+    SQLAlchemy 1.1 has no ``pool_pre_ping``; the test runs on the DBAPI
+    cursor so that it is not counted as a statement of the request.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
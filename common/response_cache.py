@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LocalBackend(object):
+    """In-process LRU of encoded responses grouped by owner, bounded both
+    by the number of entries and by the bytes they hold."""
+
+    def __init__(self, maxsize=1024, maxbytes=64 * 2 ** 20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, owner, key):
+        with self._lock:
+            value = self._data.get((owner, key))
+            if value is not None:
+                self._data.move_to_end((owner, key))
+            return value
+
+    def set(self, owner, key, value):
+        if len(value) > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop((owner, key), None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._data[owner, key] = value
+            self.nbytes += len(value)
+            while len(self._data) > self.maxsize or \
+                    self.nbytes > self.maxbytes:
+                self.nbytes -= len(self._data.popitem(last=False)[1])
+                self.evictions += 1
+
+    def invalidate(self, owner):
+        with self._lock:
+            for entry in [entry for entry in self._data
+                          if entry[0] == owner]:
+                self.nbytes -= len(self._data.pop(entry))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(backend='local', size=len(self._data),
+                        maxsize=self.maxsize, bytes=self.nbytes,
+                        maxbytes=self.maxbytes, evictions=self.evictions)
+
+
+class RedisBackend(object):
+    """Backend shared by all processes, a Redis hash per owner. Dropping
+    the hash invalidates every entry of the owner at once, ``ttl`` bounds
+    the life of hashes nobody invalidates."""
+
+    def __init__(self, client, prefix='responses', ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _name(self, owner):
+        return '{}:{}'.format(self.prefix, owner)
+
+    def get(self, owner, key):
+        return self.client.hget(self._name(owner), key)
+
+    def set(self, owner, key, value):
+        pipeline = self.client.pipeline()
+        pipeline.hset(self._name(owner), key, value)
+        pipeline.expire(self._name(owner), self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, owner):
+        self.client.delete(self._name(owner))
+
+    def clear(self):
+        for name in self.client.scan_iter('{}:*'.format(self.prefix)):
+            self.client.delete(name)
+
+    def stats(self):
+        return dict(backend='redis',
+                    bytes=self.client.info('memory').get('used_memory'))
+
+
+class ResponseCache(object):
+    """Encoded responses of a resource, stored per owner under a key the
+    resource derives from the request. Counts hits and misses, under a
+    lock since threaded workers share the cache."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def configure(self, backend):
+        with self._lock:
+            self.backend = backend
+            self.hits = self.misses = 0
+
+    def get(self, owner, key):
+        value = self.backend.get(owner, key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, owner, key, value):
+        self.backend.set(owner, key, value)
+
+    def invalidate(self, owner):
+        self.backend.invalidate(owner)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return dict(
+            hits=hits,
+            misses=misses,
+            hit_ratio=round(hits / lookups, 4) if lookups else None,
+            **self.backend.stats()
+        )
+
+
+def backend_from_config(config, prefix):
+    """Redis backend when ``<prefix>_REDIS_URL`` is set, which needs the
+    redis package, else the local backend sized by ``<prefix>_SIZE`` and
+    ``<prefix>_MAX_BYTES``."""
+    url = config.get(prefix + '_REDIS_URL')
+    if url:
+        import redis
+        return RedisBackend(redis.StrictRedis.from_url(url),
+                            prefix=prefix.lower(),
+                            ttl=config[prefix + '_TTL'])
+    return LocalBackend(maxsize=config[prefix + '_SIZE'],
+                        maxbytes=config[prefix + '_MAX_BYTES'])
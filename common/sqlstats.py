@@ -0,0 +1,226 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(__name__ + '.slow')
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class StatementCounter(object):
+    def __init__(self):
+        self.statements = []
+        self.total_time = 0.0
+        self.slowest = None
+        self.slowest_time = 0.0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, statement, duration, parameters, executemany):
+        self.statements.append(statement)
+        self.total_time += duration
+        if self.slowest is None or duration > self.slowest_time:
+            self.slowest, self.slowest_time = statement, duration
+
+
+class RequestStats(StatementCounter):
+    """Statements of one request, the ones slower than ``slow_threshold``
+    seconds are written to the slow query log as they complete."""
+
+    def __init__(self, endpoint, slow_threshold=None):
+        super().__init__()
+        self.endpoint = endpoint
+        self.slow_threshold = slow_threshold
+
+    def record(self, statement, duration, parameters, executemany):
+        super().record(statement, duration, parameters, executemany)
+        if self.slow_threshold is not None and \
+                duration >= self.slow_threshold:
+            slow_query_logger.warning(json.dumps(dict(
+                endpoint=self.endpoint,
+                duration_ms=to_ms(duration),
+                statement=statement,
+                parameters=parameter_shapes(parameters, executemany)
+            )))
+
+    def server_timing(self):
+        return 'db;desc="{} statements";dur={}'.format(
+            self.count, to_ms(self.total_time))
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _shape(value):
+    if isinstance(value, (list, tuple)):
+        return '{}[{}]'.format(type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany=False):
+    """Types of bound ``parameters``, without their values, which may be
+    large or sensitive."""
+    if executemany:
+        return '{} x {}'.format(
+            len(parameters),
+            parameter_shapes(parameters[0]) if parameters else None)
+    if isinstance(parameters, dict):
+        return {key: _shape(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_shape(value) for value in parameters]
+    return None
+
+
+def _counters():
+    try:
+        return _local.counters
+    except AttributeError:
+        _local.counters = []
+        return _local.counters
+
+
+# Both listeners return right away unless something is counting on this
+# thread. Statements of one thread run one after another, so the start
+# time of the running one is kept on the thread.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    if _counters():
+        _local.started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context,
+                      executemany):
+    counters = _counters()
+    if counters:
+        duration = time.perf_counter() - getattr(_local, 'started',
+                                                 time.perf_counter())
+        for counter in counters:
+            counter.record(statement, duration, parameters, executemany)
+
+
+@contextmanager
+def count_statements():
+    """Count statements sent to the database by the current thread while
+    the block runs. An ``executemany`` call counts as one statement, as it
+    is one round trip."""
+    counter = StatementCounter()
+    counters = _counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def check_budget(endpoint, count, limit, strict):
+    if count > limit:
+        message = '{endpoint} sent {count} statements, budget is {limit}'\
+            .format(endpoint=endpoint, count=count, limit=limit)
+        if strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def budgeted_body(body, endpoint, spent, limit, per_chunk, strict):
+    """Yield the chunks of a streamed ``body`` counting the statements
+    sent while producing them, then check the budget of the whole
+    response: ``limit`` plus ``per_chunk`` for every chunk."""
+    chunks = 0
+    with count_statements() as counter:
+        for chunk in body:
+            chunks += 1
+            yield chunk
+    check_budget(endpoint, spent + counter.count,
+                 limit + per_chunk * chunks, strict)
+
+
+def query_budget(limit, per_chunk=0):
+    """Declare that the decorated view sends at most ``limit`` statements.
+
+    Statements of a streamed body run while the server consumes it, after
+    the view returned. They are counted too, the budget then grows by
+    ``per_chunk`` statements for every chunk of the body.
+
+    Going over the budget is logged as a warning naming the endpoint, or
+    raises ``QueryBudgetExceeded`` when ``QUERY_BUDGET_STRICT`` is set, as
+    it is for tests.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_statements() as counter:
+                response = view(*args, **kwargs)
+            strict = current_app.config['QUERY_BUDGET_STRICT']
+            if isinstance(response, Response) and response.is_streamed:
+                # the body outlives the request context, read what the
+                # check needs now
+                response.response = budgeted_body(
+                    response.response, request.endpoint, counter.count,
+                    limit, per_chunk, strict)
+            else:
+                check_budget(request.endpoint, counter.count, limit, strict)
+            return response
+        return wrapper
+    return decorator
+
+
+def _start_request():
+    stats = RequestStats(request.endpoint,
+                         current_app.config['SQL_SLOW_QUERY_THRESHOLD'])
+    _counters().append(stats)
+    g.sql_stats = stats
+
+
+def _report_request(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    response.headers.add('Server-Timing', stats.server_timing())
+    logger.info(json.dumps(dict(
+        endpoint=request.endpoint,
+        method=request.method,
+        status=response.status_code,
+        statements=stats.count,
+        db_ms=to_ms(stats.total_time),
+        slowest_ms=to_ms(stats.slowest_time),
+        slowest=stats.slowest
+    )))
+    return response
+
+
+def _stop_request(exception=None):
+    stats = g.pop('sql_stats', None)
+    counters = _counters()
+    if stats in counters:
+        counters.remove(stats)
+
+
+def instrument(app):
+    """Time the statements of every request when ``SQL_TIMING`` is set.
+
+    The totals are sent back in a ``Server-Timing`` header and logged as
+    one JSON line per request. Statements taking at least
+    ``SQL_SLOW_QUERY_THRESHOLD`` seconds also go to the slow query log.
+    """
+    if not app.config['SQL_TIMING']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_report_request)
+    app.teardown_request(_stop_request)
@@ -3,3 +3,5 @@ from .config import *
 SECRET_KEY = 'i want to break free'
 SQLALCHEMY_DATABASE_URI = 'postgresql://flaskrest:password' \
                           '@localhost/test_flaskrest'
+
+QUERY_BUDGET_STRICT = True
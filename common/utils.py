@@ -1,4 +1,4 @@
-import json
+from .json_encoding import dumps, loads
 
 
 class ResponseCodes(enumerate):
@@ -9,6 +9,7 @@ class ResponseCodes(enumerate):
     UNAUTHORIZED_401 = 401
     FORBIDDEN_403 = 403
     NOT_FOUND_404 = 404
+    CONFLICT_409 = 409
     UNPROCESSABLE_ENTITY_422 = 422
     SERVER_ERROR_500 = 500
 
@@ -16,13 +17,34 @@ class ResponseCodes(enumerate):
 def template_response(status=None,
                       code=None,
                       message=None,
-                      data=None):
-    return {
+                      data=None,
+                      **extra):
+    response = {
         'status': status,
         'code': code,
         'message': message,
         'data': data
-    }, code
+    }
+    response.update(extra)
+    return response, code
+
+
+def iter_json_envelope(chunks, status=None, code=None, message=None):
+    """Yield the ``template_response`` envelope as encoded JSON, writing
+    ``data`` as an array built from ``chunks``, an iterable of lists of
+    items. One piece of bytes is produced per chunk."""
+    envelope, _ = template_response(status=status, code=code,
+                                    message=message)
+    del envelope['data']
+    yield dumps(envelope)[:-1] + b',"data":['
+
+    separator = b''
+    for chunk in chunks:
+        if chunk:
+            # the chunk is encoded as a list, its brackets are dropped
+            yield separator + dumps(chunk)[1:-1]
+            separator = b','
+    yield b']}'
 
 
 def detail_template(value):
@@ -30,7 +52,7 @@ def detail_template(value):
 
 
 def get_json(response, inner_data=False):
-    parsed_json = json.loads(str(response.data, encoding='utf-8'))
+    parsed_json = loads(response.data)
     return parsed_json.get('data') if inner_data else parsed_json
 
 
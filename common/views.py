@@ -2,15 +2,18 @@ from flask import Blueprint, request
 from flask_jwt import jwt_required, current_identity
 from flask_restful import Api
 
+from common import json_encoding
 from common.base import BaseResource
 from common.database import db_session
 from common.serializers import UserRegisterSchema
+from common.sqlstats import query_budget
 from common.utils import bytes_to_str
 from .models import User
 from .utils import ResponseCodes, template_response
 
 app_bp = Blueprint('users', __name__)
 api = Api(app_bp)
+json_encoding.register(api)
 
 
 class Register(BaseResource):
@@ -45,11 +48,12 @@ class Register(BaseResource):
 
 
 class UserDetail(BaseResource):
+    @query_budget(2)
     @jwt_required()
     def get(self, user_id):
         user = User.query.filter_by(id=user_id).first()
 
-        if not user or current_identity != user:
+        if not user or current_identity.id != user.id:
             return self._not_found()
 
         return template_response(status='OK',
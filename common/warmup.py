@@ -0,0 +1,50 @@
+import logging
+import time
+
+from sqlalchemy.orm import configure_mappers
+
+from .database import db_session, get_engine
+
+logger = logging.getLogger(__name__)
+
+_steps = []
+_statements = []
+
+
+def register_step(step):
+    """Have ``warmup`` call ``step()`` inside an app context."""
+    _steps.append(step)
+
+
+def register_statements(factory):
+    """Have ``warmup`` compile the statements ``factory()`` returns."""
+    _statements.append(factory)
+
+
+def warmup(app):
+    """Prepare the current process for its first requests.
+
+    Mappers are configured, the pool is filled with ``SQLALCHEMY_POOL_SIZE``
+    connections, which also runs the dialect's first connect queries,
+    registered statements are compiled so that type processors are cached
+    for the dialect, and registered steps are run. Call it in a worker once
+    it is forked, for example from a ``post_fork`` hook.
+    """
+    started = time.monotonic()
+    configure_mappers()
+
+    engine = get_engine()
+    connections = [engine.connect()
+                   for _ in range(app.config['SQLALCHEMY_POOL_SIZE'])]
+    for connection in connections:
+        connection.close()
+
+    with app.app_context():
+        for factory in _statements:
+            for statement in factory():
+                statement.compile(dialect=engine.dialect)
+        for step in _steps:
+            step()
+        # give back the connection the steps used
+        db_session.remove()
+    logger.info('warmed up in %.3fs', time.monotonic() - started)
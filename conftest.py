@@ -1,18 +1,21 @@
 import pytest
-from common import app as application
-from common.database import db_session as session, decl_base, sessionmaker
+from app import app as application
+from common.database import db_session as session, decl_base, get_engine, \
+    sessionmaker
+from common.jwt_functions import identity_cache
 from common.models import User
 from events.models import EVENT_STATUSES, EventStatus, Event, Label, \
     LabelsEvents
+from events.statuses import status_registry
 
 
 @pytest.yield_fixture(scope='session')
 def db_session():
-    decl_base.metadata.create_all()
+    decl_base.metadata.create_all(bind=get_engine())
 
     yield session
     sessionmaker.close_all()
-    decl_base.metadata.drop_all()
+    decl_base.metadata.drop_all(bind=get_engine())
     session.remove()
 
 
@@ -20,6 +23,7 @@ def setup(db_session):
     statuses = (EventStatus(status=s) for s in EVENT_STATUSES)
     db_session.add_all(statuses)
     db_session.commit()
+    status_registry.refresh()
 
 
 def clean(db_session):
@@ -28,6 +32,8 @@ def clean(db_session):
     db_session.query(Event).delete(synchronize_session=False)
     db_session.query(EventStatus).delete(synchronize_session=False)
     db_session.query(User).delete(synchronize_session=False)
+    identity_cache.clear()
+    status_registry.clear()
 
 
 @pytest.yield_fixture(scope='function')
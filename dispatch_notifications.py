@@ -0,0 +1,29 @@
+import argparse
+import logging
+import sys
+
+from common import create_app
+from events.notifications import FileSink, run
+
+
+def parse_args(app):
+    parser = argparse.ArgumentParser(
+        description='Deliver due event notifications.')
+    parser.add_argument('--batch-size', type=int,
+                        default=app.config['NOTIFICATIONS_BATCH_SIZE'])
+    parser.add_argument('--poll-interval', type=float,
+                        default=app.config['NOTIFICATIONS_POLL_INTERVAL'])
+    parser.add_argument('--output', type=argparse.FileType('a'),
+                        default=sys.stdout,
+                        help='file notifications are appended to')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    args = parse_args(app)
+    with app.app_context():
+        run(FileSink(args.output),
+            batch_size=args.batch_size,
+            poll_interval=args.poll_interval)
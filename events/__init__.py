@@ -1,2 +1,10 @@
 from .models import *
 from .views import api_bp as blueprint
+
+
+def init_app(app):
+    from . import list_cache
+    from .occurrences import occurrence_cache
+    occurrence_cache.configure(maxsize=app.config['OCCURRENCE_CACHE_SIZE'])
+    list_cache.configure(app.config)
+    app.register_blueprint(blueprint)
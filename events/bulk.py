@@ -0,0 +1,102 @@
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from common.database import db_session
+from .models import Event, Label, LabelsEvents
+from .statuses import UnknownStatus, status_registry
+
+EVENT_COLUMNS = ('description', 'start', 'end', 'periodic', 'period',
+                 'next_notification')
+
+Interval = namedtuple('Interval', 'start end key')
+
+RESERVE_IDS = text("""
+    SELECT nextval(pg_get_serial_sequence('events', 'id'))
+    FROM generate_series(1, :count)
+""")
+
+
+def find_overlaps(intervals):
+    """Return keys of ``intervals`` that overlap another interval.
+
+    Intervals are closed, like the single event overlap check. They are
+    sorted once and swept while remembering the interval reaching furthest
+    so far; whenever the next interval starts before that one ends, both
+    overlap. Intervals keyed with ``None`` (existing events) take part in
+    the sweep but are never reported.
+    """
+    overlapping = set()
+    furthest = None
+    for interval in sorted(intervals, key=lambda i: (i.start, i.end)):
+        if furthest is not None and interval.start <= furthest.end:
+            overlapping.update(key for key in (interval.key, furthest.key)
+                               if key is not None)
+        if furthest is None or interval.end > furthest.end:
+            furthest = interval
+    return overlapping
+
+
+def existing_intervals(user_id, start, end):
+    rows = Event.overlapping(user_id, start, end)\
+        .with_entities(Event.start, Event.end)
+    return [Interval(row.start, row.end, None) for row in rows]
+
+
+def validate_batch(user_id, items):
+    """Split loaded ``items`` (index to schema data) into accepted data
+    and per-item errors, rejecting unknown statuses and events overlapping
+    each other or events of the user."""
+    errors = {}
+    for index, data in items.items():
+        try:
+            data['status_id'] = status_registry.id_for(data.pop('status'))
+        except UnknownStatus:
+            errors[index] = {'status': ['Unknown status']}
+    items = {index: data for index, data in items.items()
+             if index not in errors}
+    if not items:
+        return items, errors
+
+    intervals = [Interval(data['start'], data['end'], index)
+                 for index, data in items.items()]
+    intervals.extend(existing_intervals(
+        user_id,
+        min(interval.start for interval in intervals),
+        max(interval.end for interval in intervals)))
+
+    for index in find_overlaps(intervals):
+        errors[index] = {'_schema': ['Event is overlapping with others']}
+        del items[index]
+    return items, errors
+
+
+def insert_events(user_id, items):
+    """Insert accepted ``items`` with one multi-row INSERT for events and
+    one for their labels. Returns the new event id of every item.
+
+    Ids are drawn from the sequence up front and inserted explicitly, the
+    way the importer stages them, so mapping them back to items does not
+    depend on the order of rows returned by the INSERT.
+    """
+    indexes = sorted(items)
+    reserved = db_session.execute(RESERVE_IDS, {'count': len(indexes)})
+    ids = dict(zip(indexes, (event_id for event_id, in reserved)))
+    rows = [dict({column: items[index].get(column)
+                  for column in EVENT_COLUMNS},
+                 id=ids[index],
+                 user_id=user_id,
+                 status_id=items[index]['status_id'])
+            for index in indexes]
+    db_session.execute(Event.__table__.insert().values(rows))
+
+    names = {name for data in items.values()
+             for name in data.get('labels') or ()}
+    if names:
+        label_ids = Label.resolve_ids(names)
+        db_session.execute(LabelsEvents.insert().values([
+            dict(event_id=ids[index], label_id=label_ids[name])
+            for index in indexes
+            for name in set(items[index].get('labels') or ())
+        ]))
+    return ids
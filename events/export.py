@@ -0,0 +1,128 @@
+import zlib
+
+import pytz
+
+from common.json_encoding import dumps
+
+from .statuses import status_registry
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'ics': ('text/calendar', 'ics'),
+}
+
+ICAL_DATETIME_FORMAT = '%Y%m%dT%H%M%SZ'
+ICAL_LINE_LENGTH = 75
+ICAL_STATUSES = {
+    'W': 'CONFIRMED',
+    'P': 'CONFIRMED',
+    'C': 'CANCELLED',
+}
+# Largest unit dividing the period wins: 14 days is FREQ=WEEKLY;INTERVAL=2.
+ICAL_FREQUENCIES = (
+    (7 * 24 * 3600, 'WEEKLY'),
+    (24 * 3600, 'DAILY'),
+    (3600, 'HOURLY'),
+    (60, 'MINUTELY'),
+    (1, 'SECONDLY'),
+)
+
+
+def iter_ndjson(chunks, dump):
+    """Yield one piece of bytes per chunk of events, an event per line in
+    the shape ``dump`` gives it."""
+    for events in chunks:
+        if events:
+            yield b''.join(dumps(dump(event)) + b'\n' for event in events)
+
+
+def ical_datetime(value):
+    return value.astimezone(pytz.utc).strftime(ICAL_DATETIME_FORMAT)
+
+
+def ical_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;')\
+        .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def ical_rrule(event):
+    """``RRULE`` repeating ``event`` every ``period`` until its ``end``,
+    periods shorter than a second cannot be expressed and give ``None``."""
+    seconds = int(event.period.total_seconds())
+    if seconds <= 0:
+        return None
+    for unit, frequency in ICAL_FREQUENCIES:
+        if seconds % unit == 0:
+            return 'FREQ={};INTERVAL={};UNTIL={}'.format(
+                frequency, seconds // unit, ical_datetime(event.end))
+
+
+def fold(line):
+    """Split ``line`` into lines of at most 75 octets as RFC 5545 asks,
+    continuation lines start with a space."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= ICAL_LINE_LENGTH:
+        return line + '\r\n'
+    parts, start, limit = [], 0, ICAL_LINE_LENGTH
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # never cut a multi-byte character in two
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, ICAL_LINE_LENGTH - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ical_event(event, stamp, domain):
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:event-{}@{}'.format(event.id, domain),
+        'DTSTAMP:{}'.format(stamp),
+        'DTSTART:{}'.format(ical_datetime(event.start)),
+    ]
+    rrule = ical_rrule(event) if event.periodic and event.period else None
+    if rrule:
+        # the end of a periodic event is the end of its series
+        lines.append('RRULE:{}'.format(rrule))
+    else:
+        lines.append('DTEND:{}'.format(ical_datetime(event.end)))
+    if event.description:
+        lines.append('SUMMARY:{}'.format(ical_text(event.description)))
+    if event.place:
+        lines.append('LOCATION:{}'.format(ical_text(event.place)))
+    if event.labels:
+        lines.append('CATEGORIES:{}'.format(
+            ','.join(ical_text(label.name) for label in event.labels)))
+    status = ICAL_STATUSES.get(status_registry.code_for(event.status_id))
+    if status:
+        lines.append('STATUS:{}'.format(status))
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+def iter_ical(chunks, stamp, domain):
+    """Yield a ``VCALENDAR`` with a ``VEVENT`` per event, one piece of
+    text per chunk of events."""
+    stamp = ical_datetime(stamp)
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\n' \
+        'PRODID:-//{}//events//EN\r\n'.format(domain)
+    for events in chunks:
+        if events:
+            yield ''.join(ical_event(event, stamp, domain)
+                          for event in events)
+    yield 'END:VCALENDAR\r\n'
+
+
+def iter_gzip(pieces, level=6):
+    """Gzip text or bytes ``pieces`` on the fly. Every piece is flushed so
+    that each one reaches the client as soon as it is produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        data = compressor.compress(piece) + \
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,306 @@
+import csv
+import io
+import json
+import logging
+import time
+from itertools import chain
+
+from sqlalchemy import text
+
+from common.database import db_session
+from .serializers import EventCreateSchema
+from .statuses import UnknownStatus, status_registry
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv')
+
+CSV_LABEL_SEPARATOR = ';'
+
+STAGING_COLUMNS = ('line', 'description', 'start', '"end"', 'periodic',
+                   'period', 'next_notification', 'status_id', 'labels')
+
+CREATE_STAGING = text("""
+    CREATE TEMPORARY TABLE events_import (
+        line integer NOT NULL,
+        event_id integer NOT NULL
+            DEFAULT nextval(pg_get_serial_sequence('events', 'id')),
+        description text,
+        start timestamptz NOT NULL,
+        "end" timestamptz NOT NULL,
+        periodic boolean,
+        period interval,
+        next_notification timestamptz,
+        status_id integer,
+        labels varchar(100)[]
+    )
+""")
+
+INDEX_STAGING = text(
+    'CREATE INDEX ON events_import (start, "end", line)')
+
+DROP_STAGING = text('DROP TABLE events_import')
+
+COPY_STAGING = 'COPY events_import ({}) FROM STDIN WITH (FORMAT csv)'\
+    .format(', '.join(STAGING_COLUMNS))
+
+# Rows overlapping existing events of the user, then rows overlapping an
+# earlier kept row of the file, are dropped from staging. Both statements
+# report how many rows they dropped and the first few line numbers.
+REJECT_OVERLAPPING_EXISTING = text("""
+    WITH rejected AS (
+        DELETE FROM events_import USING events
+        WHERE events.user_id = :user_id
+          AND events."end" IS NOT NULL
+          AND tstzrange(events.start, events."end", '[]') &&
+              tstzrange(events_import.start, events_import."end", '[]')
+        RETURNING events_import.line
+    )
+    SELECT count(*), (array_agg(line ORDER BY line))[1:CAST(:sample AS int)]
+    FROM rejected
+""")
+
+# Rows are walked in (start, end, line) order, one index lookup per row,
+# carrying the end of the last kept row. A row starting before that end
+# is rejected and does not move it, so a rejected row never causes the
+# rejection of a later one: of [1,3], [2,20] and [10,11] only [2,20] goes.
+REJECT_OVERLAPPING_IMPORTED = text("""
+    WITH RECURSIVE walk AS (
+        (SELECT line, start, "end", "end" AS kept_end, false AS rejected
+         FROM events_import
+         ORDER BY start, "end", line
+         LIMIT 1)
+        UNION ALL
+        SELECT next.line, next.start, next."end",
+               CASE WHEN next.start <= walk.kept_end THEN walk.kept_end
+                    ELSE next."end" END,
+               next.start <= walk.kept_end
+        FROM walk, LATERAL (
+            SELECT line, start, "end"
+            FROM events_import
+            WHERE (start, "end", line) > (walk.start, walk."end", walk.line)
+            ORDER BY start, "end", line
+            LIMIT 1
+        ) AS next
+    ), rejected AS (
+        DELETE FROM events_import USING walk
+        WHERE events_import.line = walk.line AND walk.rejected
+        RETURNING events_import.line
+    )
+    SELECT count(*), (array_agg(line ORDER BY line))[1:CAST(:sample AS int)]
+    FROM rejected
+""")
+
+MERGE_LABELS = text("""
+    INSERT INTO labels (name)
+    SELECT DISTINCT unnest(labels) FROM events_import
+    ON CONFLICT (name) DO NOTHING
+""")
+
+MERGE_EVENTS = text("""
+    INSERT INTO events (id, user_id, description, start, "end",
+                        periodic, period, next_notification, status_id)
+    SELECT event_id, :user_id, description, start, "end",
+           periodic, period, next_notification, status_id
+    FROM events_import
+""")
+
+MERGE_LABELS_EVENTS = text("""
+    INSERT INTO labels_events (event_id, label_id)
+    SELECT DISTINCT events_import.event_id, labels.id
+    FROM events_import
+    CROSS JOIN LATERAL unnest(events_import.labels) AS names (name)
+    JOIN labels ON labels.name = names.name
+""")
+
+
+class ImportReport(object):
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.started = time.monotonic()
+        self.finished = None
+        self.read = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    def _add_error(self, line, errors):
+        if len(self.errors) < self.max_errors:
+            self.errors.append(dict(line=line, errors=errors))
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        self._add_error(line, errors)
+
+    def reject_many(self, count, lines, message):
+        """Count ``count`` rejected rows of which ``lines`` is a sample."""
+        self.rejected += count
+        for line in lines or ():
+            self._add_error(line, {'_schema': [message]})
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def to_json(self):
+        return dict(
+            read=self.read,
+            imported=self.imported,
+            rejected=self.rejected,
+            errors=sorted(self.errors, key=lambda error: error['line']),
+            seconds=round(self.elapsed, 3),
+            rows_per_second=round(self.read / self.elapsed, 1)
+            if self.elapsed else None
+        )
+
+
+def iter_ndjson(lines):
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+def iter_csv(lines):
+    """Read CSV with a header row, labels being separated by
+    ``CSV_LABEL_SEPARATOR`` inside their cell. Empty cells are treated as
+    missing values."""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        record = {key: value for key, value in record.items()
+                  if key and value not in (None, '')}
+        if 'labels' in record:
+            record['labels'] = [label for label in
+                                record['labels'].split(CSV_LABEL_SEPARATOR)
+                                if label]
+        yield reader.line_num, record
+
+
+RECORD_READERS = dict(ndjson=iter_ndjson, csv=iter_csv)
+
+
+def _array_literal(values):
+    return '{' + ','.join(
+        '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+        for value in values) + '}'
+
+
+def _staging_row(line_number, data):
+    period = data.get('period')
+    return (
+        line_number,
+        data.get('description'),
+        data['start'].isoformat(),
+        data['end'].isoformat(),
+        {True: 't', False: 'f'}.get(data.get('periodic')),
+        # days are kept apart like psycopg2 does, '1 day' and '24 hours'
+        # differ when added to timestamps across DST changes
+        '{} days {}.{:06d} seconds'.format(
+            period.days, period.seconds, period.microseconds)
+        if period else None,
+        data['next_notification'].isoformat(),
+        data['status_id'],
+        _array_literal(set(data['labels'])) if data.get('labels') else None
+    )
+
+
+def iter_staging_csv(records, report):
+    """Validate ``records`` with the rules of ``EventCreateSchema`` and
+    yield valid ones as CSV text for COPY, one line at a time. Malformed
+    records, missing fields included, are rejected with their line."""
+    schema = EventCreateSchema(context={'check_overlap': False})
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line_number, record in records:
+        report.read += 1
+        if not isinstance(record, dict):
+            report.reject(line_number, {'_schema': ['Invalid record']})
+            continue
+        data, errors = schema.load(record)
+        if not errors:
+            try:
+                data['status_id'] = status_registry.id_for(data['status'])
+            except UnknownStatus:
+                errors = {'status': ['Unknown status']}
+        if errors:
+            report.reject(line_number, errors)
+            continue
+
+        writer.writerow(_staging_row(line_number, data))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class IteratorReader(io.RawIOBase):
+    """Minimal readable file over an iterator of strings, used to feed
+    COPY without building the whole payload in memory."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk.encode('utf-8')
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def import_events(user_id, lines, fmt, max_errors=100):
+    """Import events read from ``lines`` (an iterable of text lines in
+    ``fmt``) for ``user_id`` in one transaction and return the report.
+
+    Records are validated one at a time and streamed into a temporary
+    staging table with COPY, then merged into events, labels and
+    labels_events with set based statements, so memory use does not
+    depend on the size of the input. Rows overlapping an existing event
+    or an earlier kept row of the input are rejected.
+    """
+    report = ImportReport(max_errors)
+    records = RECORD_READERS[fmt](lines)
+    # the first record is read before the staging table exists, so that
+    # a record that fails validation right away needs no round trip
+    staged_rows = iter_staging_csv(records, report)
+    first_row = next(staged_rows, None)
+    try:
+        if first_row is not None:
+            db_session.execute(CREATE_STAGING)
+            cursor = db_session.connection().connection.cursor()
+            cursor.copy_expert(COPY_STAGING, IteratorReader(
+                chain([first_row], staged_rows)))
+            db_session.execute(INDEX_STAGING)
+            params = dict(user_id=user_id, sample=max_errors)
+            for statement, message in (
+                    (REJECT_OVERLAPPING_EXISTING,
+                     'Event is overlapping with others'),
+                    (REJECT_OVERLAPPING_IMPORTED,
+                     'Event is overlapping with an earlier event')):
+                count, sample = db_session.execute(statement, params).first()
+                report.reject_many(count, sample, message)
+
+            db_session.execute(MERGE_LABELS)
+            report.imported = db_session.execute(MERGE_EVENTS,
+                                                 params).rowcount
+            db_session.execute(MERGE_LABELS_EVENTS)
+            db_session.execute(DROP_STAGING)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+    report.finished = time.monotonic()
+    logger.info('event import for user %s: %s', user_id,
+                json.dumps(report.to_json()))
+    return report
@@ -0,0 +1,34 @@
+from sqlalchemy import event as sa_event
+
+from common import metrics
+from common.models import User
+from common.response_cache import ResponseCache, backend_from_config
+from .models import Event
+
+# Encoded EventList pages per user. Entries are keyed by the list ETag,
+# which every version bump of the user's events changes, so a write can
+# never be answered with stale bytes, not even a write made by another
+# process. Writers in this process also drop the user's entries, so that
+# entries nobody can hit any more do not hold memory until evicted.
+list_cache = ResponseCache()
+metrics.register('events_list_cache', list_cache.stats)
+
+
+def configure(config):
+    list_cache.configure(backend_from_config(config, 'EVENTS_LIST_CACHE'))
+
+
+def invalidate(user_id):
+    list_cache.invalidate(user_id)
+
+
+@sa_event.listens_for(Event, 'after_insert')
+@sa_event.listens_for(Event, 'after_update')
+@sa_event.listens_for(Event, 'after_delete')
+def _invalidate_changed_event(mapper, connection, target):
+    invalidate(target.user_id)
+
+
+@sa_event.listens_for(User, 'after_update')
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate(target.id)
@@ -1,12 +1,14 @@
 from common.database import db_session, Base, decl_base
 from sqlalchemy_utils.types import ChoiceType
 from sqlalchemy import (
-    Column, Integer, String, Text, Table,
-    ForeignKey, DateTime, Boolean
+    DDL, Column, Integer, String, Text, Table,
+    ForeignKey, DateTime, Boolean, Float, Index, PrimaryKeyConstraint, and_,
+    cast, exists, func, literal_column, select, text
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import make_transient_to_detached, relationship
 
-from sqlalchemy.dialects.postgresql import INTERVAL
+from sqlalchemy.dialects.postgresql import INTERVAL, TSVECTOR
 
 
 EVENT_STATUSES = ('W', 'P', 'C')
@@ -21,6 +23,53 @@ EVENT_CREATE_CHOICES = (
 )
 
 
+def span(start, end):
+    """Closed ``tstzrange`` between ``start`` and ``end``.
+
+    Built the same way for columns and for bound values so that
+    ``span(Event.start, Event.end)`` matches the ``ix_events_span``
+    expression index.
+    """
+    return func.tstzrange(start, end, literal_column("'[]'"))
+
+
+# Text search configuration of event search, 'simple' neither stems nor
+# drops stop words, descriptions are written in any language.
+SEARCH_CONFIG = 'simple'
+
+# Search document of an event. Postgres keeps it in the generated column
+# events.search. Searches are always by user, so the document is indexed
+# together with user_id by ix_events_user_id_search, which needs the
+# btree_gin extension. SQLAlchemy 1.1 cannot declare generated columns, so
+# the column and index are added by DDL after the table is created, and by
+# migrations 7c4e2b9f0a13 and e2f7a4c9b1d6. Where btree_gin is not
+# installed the DDL falls back to indexing the document alone. The column
+# stays out of the mapper: inserts never send it and eager defaults never
+# read it back.
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('{config}', coalesce(description, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce(place, '')), 'B')"
+).format(config=SEARCH_CONFIG)
+ADD_SEARCH_COLUMN = 'ALTER TABLE events ADD COLUMN search tsvector ' \
+                    'GENERATED ALWAYS AS ({}) STORED'.format(SEARCH_DOCUMENT)
+CREATE_SEARCH_INDEX = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT FROM pg_available_extensions
+               WHERE name = 'btree_gin') THEN
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+        CREATE INDEX ix_events_user_id_search ON events
+            USING gin (user_id, search);
+    ELSE
+        CREATE INDEX ix_events_search ON events USING gin (search);
+    END IF;
+END
+$$
+"""
+
+search_document = literal_column('events.search', type_=TSVECTOR)
+
+
 class EventStatus(Base):
     __tablename__ = 'event_statuses'
 
@@ -31,7 +80,10 @@ LabelsEvents = Table(
     'labels_events',
     decl_base.metadata,
     Column('label_id', Integer, ForeignKey('labels.id')),
-    Column('event_id', Integer, ForeignKey('events.id'))
+    Column('event_id', Integer, ForeignKey('events.id')),
+    # labels of events are read by event, events of a label by label
+    PrimaryKeyConstraint('event_id', 'label_id'),
+    Index('ix_labels_events_label_id_event_id', 'label_id', 'event_id')
 )
 
 
@@ -41,21 +93,51 @@ class Label(Base):
     name = Column(String(100))
     events = relationship('Event', secondary=LabelsEvents)
 
-    @classmethod
-    def create_non_existing(cls, labels_list):
-        existing_labels = db_session\
-            .query(Label.name)\
-            .filter(Label.name.in_(labels_list))
+    __table_args__ = (
+        Index('ix_labels_name', name, unique=True),
+    )
 
-        not_existing_labels = set(labels_list) - set(existing_labels.all())
+    # Inserts missing names and reads the existing ones back in a single
+    # round trip. Rows inserted by the statement are not visible to its own
+    # SELECT, hence the UNION of both parts.
+    resolve_statement = text("""
+        WITH names (name) AS (
+            SELECT DISTINCT unnest(CAST(:names AS varchar[]))
+        ), inserted AS (
+            INSERT INTO labels (name) SELECT name FROM names
+            ON CONFLICT (name) DO NOTHING
+            RETURNING id, name
+        )
+        SELECT id, name FROM inserted
+        UNION ALL
+        SELECT labels.id, labels.name FROM labels JOIN names USING (name)
+    """)
 
-        db_session.add_all((Label(name=name) for name in not_existing_labels))
-        db_session.commit()
+    @classmethod
+    def resolve_ids(cls, label_list):
+        """Map every name of ``label_list`` to a label id, creating labels
+        that do not exist yet. Nothing is committed."""
+        names = set(label_list)
+        ids = {}
+        while names - set(ids):
+            # a name inserted by a concurrent transaction after this
+            # statement started is neither inserted nor selected, asking
+            # again picks it up
+            rows = db_session.execute(cls.resolve_statement,
+                                      {'names': list(names - set(ids))})
+            ids.update((name, label_id) for label_id, name in rows)
+        return ids
 
     @classmethod
     def create_all(cls, label_list):
-        Label.create_non_existing(label_list)
-        return db_session.query(Label).filter(Label.name.in_(label_list))
+        """Return labels named in ``label_list`` attached to the session
+        without selecting them again."""
+        labels = []
+        for name, label_id in cls.resolve_ids(label_list).items():
+            label = cls(id=label_id, name=name)
+            make_transient_to_detached(label)
+            labels.append(db_session.merge(label, load=False))
+        return labels
 
 
 class Event(Base):
@@ -75,6 +157,99 @@ class Event(Base):
     status = relationship('EventStatus')
     labels = relationship('Label', secondary=LabelsEvents)
     media = relationship('EventMedia')
+    updated_at = Column(DateTime(timezone=True), nullable=False,
+                        server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, server_default='1',
+                     onupdate=text('version + 1'))
+
+    # values computed by the database are read back by the INSERT or UPDATE
+    # statement itself, responses read them right after the commit
+    __mapper_args__ = {'eager_defaults': True}
+
+    __table_args__ = (
+        Index('ix_events_span', span(start, end), postgresql_using='gist'),
+        Index('ix_events_user_id_start_id', 'user_id', 'start', 'id'),
+        Index('ix_events_next_notification', next_notification,
+              postgresql_where=next_notification.isnot(None)),
+        # waiting events that ended, for the sweeper
+        Index('ix_events_status_id_end', 'status_id', 'end'),
+        # covers the validator of conditional list requests
+        Index('ix_events_user_id_updated_at_version',
+              'user_id', 'updated_at', 'version'),
+    )
+
+    @classmethod
+    def overlapping(cls, user_id, start, end):
+        return db_session.query(cls)\
+            .filter(cls.user_id == user_id,
+                    cls.end.isnot(None),
+                    span(cls.start, cls.end).op('&&')(span(start, end)))
+
+    @classmethod
+    def in_window(cls, window_start=None, window_end=None):
+        """Criterion for events intersecting ``[window_start, window_end)``,
+        a missing bound leaves that side of the window open.
+
+        The redundant ``start`` bound lets the ``(user_id, start)`` index
+        stop at the end of the window, the range overlap is served by
+        ``ix_events_span``.
+        """
+        window = func.tstzrange(window_start, window_end,
+                                literal_column("'[)'"))
+        criterion = span(cls.start, cls.end).op('&&')(window)
+        if window_end is not None:
+            criterion = and_(criterion, cls.start < window_end)
+        return criterion
+
+    @classmethod
+    def labelled(cls, names, match_all=False):
+        """Criterion for events carrying any of the labels ``names``, or
+        all of them with ``match_all``.
+
+        Every label is an EXISTS the planner turns into a semi-join, run
+        from the events through the primary key of ``labels_events`` or,
+        for rare labels, from the label through the reverse index.
+        """
+        def carrying(names):
+            return exists().where(and_(
+                LabelsEvents.c.event_id == cls.id,
+                LabelsEvents.c.label_id.in_(
+                    select([Label.id]).where(Label.name.in_(names)))))
+
+        if match_all:
+            return and_(*(carrying([name]) for name in set(names)))
+        return carrying(set(names))
+
+    @classmethod
+    def label_counts(cls, user_id):
+        """Query of ``(name, count)`` of every label of the events of
+        ``user_id``, most used first."""
+        count = func.count().label('count')
+        return db_session.query(Label.name, count)\
+            .join(LabelsEvents, LabelsEvents.c.label_id == Label.id)\
+            .join(cls, cls.id == LabelsEvents.c.event_id)\
+            .filter(cls.user_id == user_id)\
+            .group_by(Label.name)\
+            .order_by(count.desc(), Label.name)
+
+    @classmethod
+    def matching(cls, text):
+        """Criterion and rank of events matching the search ``text``,
+        written the way web search engines take it: words, "phrases", OR
+        and -excluded words.
+
+        The rank is cast to double precision so that it survives a round
+        trip through a keyset cursor unchanged.
+        """
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+        return search_document.op('@@')(query), \
+            cast(func.ts_rank_cd(search_document, query), Float(53))
+
+
+sa_event.listen(Event.__table__, 'after_create',
+                DDL(ADD_SEARCH_COLUMN).execute_if(dialect='postgresql'))
+sa_event.listen(Event.__table__, 'after_create',
+                DDL(CREATE_SEARCH_INDEX).execute_if(dialect='postgresql'))
 
 
 class EventMedia(Base):
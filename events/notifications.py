@@ -0,0 +1,154 @@
+import json
+import logging
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import DateTime, and_, case, cast, extract, func, or_
+
+from common.database import db_session
+from .models import Event
+from .statuses import status_registry
+
+logger = logging.getLogger(__name__)
+
+Notification = namedtuple('Notification', [
+    'event_id', 'user_id', 'description', 'place', 'start', 'notify_at'
+])
+
+
+class InMemorySink(object):
+    def __init__(self):
+        self.notifications = []
+
+    def deliver(self, notifications):
+        self.notifications.extend(notifications)
+
+
+class FileSink(object):
+    """Writes every notification as a JSON line to ``stream``."""
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+
+    def deliver(self, notifications):
+        for notification in notifications:
+            line = dict(notification._asdict(),
+                        start=notification.start.isoformat(),
+                        notify_at=notification.notify_at.isoformat())
+            self.stream.write(json.dumps(line) + '\n')
+        self.stream.flush()
+
+
+class DispatcherMetrics(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.batches = 0
+        self.delivered = 0
+        self.lag = timedelta(0)
+
+    def record(self, delivered, lag):
+        self.batches += 1
+        self.delivered += delivered
+        self.lag = lag
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.delivered / elapsed if elapsed else 0.0
+
+    def to_json(self):
+        return dict(
+            batches=self.batches,
+            delivered=self.delivered,
+            throughput=round(self.throughput, 2),
+            lag=self.lag.total_seconds()
+        )
+
+
+def next_notification_after_delivery(now):
+    """Periodic events are reminded again at the first reminder time
+    after ``now`` as long as the series lasts, other events are not
+    reminded any more.
+
+    That is one period later, or more after the dispatcher fell behind:
+    a daily event notified five days late is delivered once, not five
+    times.
+    """
+    periods_behind = func.floor(
+        extract('epoch', cast(now, DateTime(timezone=True)) -
+                Event.next_notification) /
+        extract('epoch', Event.period))
+    advanced = Event.next_notification + Event.period * (periods_behind + 1)
+    return case([(and_(Event.periodic,
+                       Event.period > timedelta(0),
+                       or_(Event.end.is_(None), advanced <= Event.end)),
+                  advanced)],
+                else_=None)
+
+
+def dispatch_batch(sink, batch_size, now=None, metrics=None):
+    """Claim up to ``batch_size`` due notifications, deliver them to
+    ``sink`` and move their ``next_notification`` forward, all in one
+    transaction.
+
+    Claimed rows are locked with ``FOR UPDATE SKIP LOCKED``, so several
+    dispatchers can run side by side without delivering a notification
+    twice. If delivery fails the transaction is rolled back and the rows
+    are claimed again later. Returns the number of claimed rows.
+    """
+    now = now or datetime.now(pytz.utc)
+    due = db_session\
+        .query(Event.id, Event.user_id, Event.description, Event.place,
+               Event.start, Event.next_notification, Event.status_id)\
+        .filter(Event.next_notification <= now)\
+        .order_by(Event.next_notification)\
+        .limit(batch_size)\
+        .with_for_update(skip_locked=True)\
+        .all()
+    if not due:
+        db_session.commit()
+        return 0
+
+    try:
+        notifications = [
+            Notification(event_id, user_id, description, place, start,
+                         notify_at)
+            for event_id, user_id, description, place, start, notify_at,
+            status_id in due
+            if status_registry.code_for(status_id) != 'C'
+        ]
+        sink.deliver(notifications)
+
+        db_session.query(Event)\
+            .filter(Event.id.in_([row.id for row in due]))\
+            .update({Event.next_notification:
+                     next_notification_after_delivery(now),
+                     Event.updated_at: func.now(),
+                     Event.version: Event.version + 1},
+                    synchronize_session=False)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+    if metrics is not None:
+        metrics.record(len(notifications), now - due[0].next_notification)
+    return len(due)
+
+
+def run(sink, batch_size, poll_interval, metrics=None, report_every=60):
+    """Dispatch notifications until interrupted, draining full batches
+    back to back and sleeping ``poll_interval`` seconds when idle."""
+    metrics = metrics or DispatcherMetrics()
+    reported = time.monotonic()
+    while True:
+        claimed = dispatch_batch(sink, batch_size, metrics=metrics)
+        if time.monotonic() - reported >= report_every:
+            logger.info('notification dispatcher %s',
+                        json.dumps(metrics.to_json()))
+            reported = time.monotonic()
+        if claimed < batch_size:
+            time.sleep(poll_interval)
@@ -0,0 +1,130 @@
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from sqlalchemy import event as sa_event
+
+from common.cache import LRUCache
+from .models import Event
+
+
+def _weigh(entry):
+    return max(1, len(entry[1]))
+
+
+# Occurrences read by earlier requests per event and window, bounded by
+# the number of occurrences they hold, see OCCURRENCE_CACHE_SIZE.
+occurrence_cache = LRUCache(weigh=_weigh)
+
+
+def is_recurring(event):
+    return bool(event.periodic and event.period and
+                event.period > timedelta(0))
+
+
+def iter_occurrences(event, window_start, window_end):
+    """Yield start times of occurrences of ``event`` inside
+    ``[window_start, window_end)`` in ascending order.
+
+    The window bounds the start of occurrences, whether the event repeats
+    or not: an occurrence that began before the window is left out even
+    if it is still going on when the window opens.
+
+    A periodic event repeats every ``period`` from ``start`` until ``end``.
+    The first occurrence inside the window is computed directly, so the
+    cost depends on the size of the window and not on how long ago the
+    series began. An event that does not repeat has a single occurrence.
+    """
+    if not is_recurring(event):
+        if window_start <= event.start < window_end:
+            yield event.start
+        return
+
+    period = event.period
+    skipped = max(0, -((event.start - window_start) // period))
+    occurrence = event.start + skipped * period
+    while occurrence < window_end and \
+            (event.end is None or occurrence <= event.end):
+        yield occurrence
+        occurrence += period
+
+
+def _fingerprint(event):
+    return event.start, event.end, event.periodic, event.period
+
+
+class _Expansion(object):
+    """Occurrences of an event in a window, read lazily: first the ones
+    cached by earlier requests, then computed ones. ``save`` caches the
+    occurrences read so far, never more than a request needed.
+
+    Entries remember the event borders they were computed from, so an
+    entry left over from before a change is never served.
+    """
+
+    def __init__(self, event, window_start, window_end):
+        self.event = event
+        self.window_end = window_end
+        self.key = event.id, window_start, window_end
+        self.fingerprint = _fingerprint(event)
+        cached = occurrence_cache.get(self.key)
+        if cached is not None and cached[0] == self.fingerprint:
+            self.read, self.complete = list(cached[1]), cached[2]
+        else:
+            self.read, self.complete = [], False
+        self.cached = len(self.read)
+        self.resume_at = window_start
+
+    def __iter__(self):
+        for start in self.read[:self.cached]:
+            yield start
+        if self.complete:
+            return
+        if self.read:
+            # the window bounds starts, so the next occurrence is the
+            # first one starting after the last one read
+            self.resume_at = self.read[-1] + timedelta(microseconds=1)
+        for start in iter_occurrences(self.event, self.resume_at,
+                                      self.window_end):
+            self.read.append(start)
+            yield start
+        self.complete = True
+
+    def save(self):
+        if len(self.read) > self.cached or self.complete:
+            occurrence_cache.set(self.key, (self.fingerprint,
+                                            tuple(self.read), self.complete))
+
+
+def expand(events, window_start, window_end, limit):
+    """Yield ``(event, start)`` pairs of all ``events`` in the window
+    ordered by start, stopping after ``limit`` occurrences.
+
+    The occurrences of every event are merged lazily, so the work depends
+    on ``limit`` and the number of events, not on their product. The
+    occurrences read are cached once the merge stops.
+    """
+    expansions = [_Expansion(event, window_start, window_end)
+                  for event in events]
+
+    def tagged(expansion):
+        for start in expansion:
+            yield start, expansion.event.id, expansion.event
+
+    merged = heapq.merge(*(tagged(expansion) for expansion in expansions))
+    try:
+        for start, _, event in islice(merged, limit):
+            yield event, start
+    finally:
+        for expansion in expansions:
+            expansion.save()
+
+
+def invalidate(event_id):
+    occurrence_cache.discard_where(lambda key: key[0] == event_id)
+
+
+@sa_event.listens_for(Event, 'after_update')
+@sa_event.listens_for(Event, 'after_delete')
+def _invalidate_changed_event(mapper, connection, target):
+    invalidate(target.id)
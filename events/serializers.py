@@ -1,22 +1,27 @@
 from datetime import timedelta
 
+from dateutil.parser import parse as parse_datetime
 from dateutil.relativedelta import relativedelta
+from flask import current_app
 from flask_jwt import current_identity
 from flask_marshmallow import Schema
 from marshmallow import fields
 from marshmallow.decorators import pre_dump, validates_schema
 from marshmallow.exceptions import ValidationError
 from marshmallow.fields import Field
+from marshmallow.validate import Length, OneOf, Range
+from sqlalchemy.orm import make_transient_to_detached
 
-from common import app
 from common.database import db_session
+from common.datetimes import DateTime
+from common.fastdump import compile_dump
 from common.models import User
+from common.pagination import InvalidCursor, decode_cursor, encode_cursor
 from common.utils import timedelta_to_hms
 from events.models import EventStatus, Label
+from .export import FORMATS as EXPORT_FORMATS
 from .models import Event
-
-
-DATETIME_FORMAT = app.config['DATETIME_FORMAT']
+from .statuses import status_registry
 
 
 class PeriodField(Field):
@@ -45,14 +50,59 @@ class PeriodField(Field):
                          seconds=seconds)
 
 
+def encode_event_cursor(event):
+    return encode_cursor([event.start.isoformat(), event.id])
+
+
+class EventCursorField(Field):
+    """Opaque keyset cursor holding ``(start, id)`` of the last event of
+    a page, as produced by ``encode_event_cursor``."""
+
+    def _deserialize(self, value, attr, data):
+        try:
+            start, event_id = decode_cursor(value)
+            return parse_datetime(start), int(event_id)
+        except (InvalidCursor, TypeError, ValueError):
+            raise ValidationError('Invalid cursor')
+
+
+class SearchCursorField(Field):
+    """Opaque keyset cursor holding ``(rank, id)`` of the last event of
+    a page of search results."""
+
+    def _deserialize(self, value, attr, data):
+        try:
+            rank, event_id = decode_cursor(value)
+            return float(rank), int(event_id)
+        except (InvalidCursor, TypeError, ValueError):
+            raise ValidationError('Invalid cursor')
+
+
+class LabelNamesField(Field):
+    """Comma separated label names, at most ``max_names`` of them."""
+
+    def __init__(self, max_names=10, **kwargs):
+        super(LabelNamesField, self).__init__(**kwargs)
+        self.max_names = max_names
+
+    def _deserialize(self, value, attr, data):
+        names = [name.strip() for name in str(value).split(',')
+                 if name.strip()]
+        if not 0 < len(names) <= self.max_names:
+            raise ValidationError('Expected 1 to {} label names'
+                                  .format(self.max_names))
+        return names
+
+
 class EventStatusSchema(Schema):
     status = fields.Str()
 
     def make_model(self, data):
-        return db_session.query(EventStatus)\
-            .filter(EventStatus.status == data['status'])\
-            .limit(1)\
-            .first()
+        status = EventStatus(id=status_registry.id_for(data['status']),
+                             status=data['status'])
+        # the row is known to exist, attach it without selecting it again
+        make_transient_to_detached(status)
+        return db_session.merge(status, load=False)
 
     @pre_dump
     def pre_dump(self, data):
@@ -61,9 +111,9 @@ class EventStatusSchema(Schema):
 
 
 class DateTimeEventMixin(Schema):
-    start = fields.DateTime(format=DATETIME_FORMAT)
-    end = fields.DateTime(format=DATETIME_FORMAT)
-    next_notification = fields.DateTime(format=DATETIME_FORMAT, required=False)
+    start = DateTime()
+    end = DateTime()
+    next_notification = DateTime(required=False)
 
 
 class UserSchema(Schema):
@@ -83,13 +133,13 @@ class EventMediaSchema(Schema):
 
 class EventSchema(DateTimeEventMixin):
     id = fields.Integer()
+    version = fields.Integer()
     user = fields.Nested(UserSchema)
     description = fields.Str()
 
     periodic = fields.Boolean(required=True, default=False)
     period = PeriodField()
-    next_notification = fields.DateTime(format=DATETIME_FORMAT,
-                                        required=False, default=None)
+    next_notification = DateTime(required=False, default=None)
     place = fields.Str()
     status = fields.Method('dump_status')
     labels = fields.Method('dump_labels', required=False)
@@ -99,10 +149,78 @@ class EventSchema(DateTimeEventMixin):
         return [l.name for l in data.labels]
 
     def dump_status(self, data):
-        return data.status.status.code
+        return status_registry.code_for(data.status_id)
+
+
+# EventSchema compiled once per process, responses are built with these
+# instead of a new schema per request
+dump_event = compile_dump(EventSchema())
+
+
+def dump_events(events):
+    return [dump_event(event) for event in events]
+
+
+class EventWindowSchema(Schema):
+    window_start = DateTime(load_from='from')
+    window_end = DateTime(load_from='to')
+
+    @validates_schema
+    def validate_window(self, data):
+        window_start = data.get('window_start')
+        window_end = data.get('window_end')
+        if window_start and window_end and window_start >= window_end:
+            raise ValidationError('Invalid window borders',
+                                  field_names=['from', 'to'])
+
+
+def page_size_field(default_key, max_key):
+    """Integer field for a page size, its default and its maximum are
+    read from the config of the running app."""
+    def validate(value):
+        Range(min=1, max=current_app.config[max_key])(value)
+    return fields.Integer(missing=lambda: current_app.config[default_key],
+                          validate=validate)
+
+
+class EventListArgsSchema(EventWindowSchema):
+    limit = page_size_field('EVENTS_PAGE_SIZE', 'EVENTS_MAX_PAGE_SIZE')
+    cursor = EventCursorField()
+    all = fields.Boolean(missing=False)
+    labels = LabelNamesField()
+    labels_match = fields.Str(missing='any', validate=OneOf(('any', 'all')))
+
+
+class EventSearchArgsSchema(Schema):
+    q = fields.Str(required=True, validate=Length(min=1, max=256))
+    limit = page_size_field('EVENTS_PAGE_SIZE', 'EVENTS_MAX_PAGE_SIZE')
+    cursor = SearchCursorField()
+
+
+class EventExportArgsSchema(EventWindowSchema):
+    format = fields.Str(missing='ndjson', validate=OneOf(EXPORT_FORMATS))
+
+
+class OccurrencesArgsSchema(EventWindowSchema):
+    window_start = DateTime(load_from='from', required=True)
+    window_end = DateTime(load_from='to', required=True)
+    limit = page_size_field('OCCURRENCES_PAGE_SIZE',
+                            'OCCURRENCES_MAX_PAGE_SIZE')
+
+
+class LabelFacetSchema(Schema):
+    name = fields.Str()
+    count = fields.Integer()
+
+
+class OccurrenceSchema(Schema):
+    event_id = fields.Integer()
+    start = DateTime()
 
 
 class EventCreateSchema(DateTimeEventMixin):
+    start = DateTime(required=True)
+    end = DateTime(required=True)
     user = fields.Nested(UserSchema)
     description = fields.Str()
     status = fields.Method('get_status', required=True)
@@ -116,34 +234,21 @@ class EventCreateSchema(DateTimeEventMixin):
         event = Event(**data)
 
         labels_list = data.pop('labels', [])
-        if labels_list:
-            labels = Label.create_all(labels_list).all()
-        else:
-            labels = []
-        event.labels = labels
-
-        user_id = db_session.query(User.id)\
-            .filter(current_identity.username == User.username,
-                    current_identity.email == User.email)\
-            .first()
-        if not user_id:
-            raise Exception('no user found for JWT')
-        event.user_id = user_id[0]
-
-        event_status_id = db_session.query(EventStatus.id)\
-            .filter(EventStatus.status == status)\
-            .first()
-        if not event_status_id:
-            raise Exception('No status found for key {}'.format(status))
-
-        event.status_id = event_status_id[0]
+        event.labels = Label.create_all(labels_list) if labels_list else []
+
+        event.user = User.from_identity(current_identity)
+        event.status_id = status_registry.id_for(status)
+
+        # new events have no media, setting it spares a lazy load on dump
+        event.media = []
 
         return event
 
     def get_status(self, obj):
-        return obj.status.status.code
+        return status_registry.code_for(obj.status_id)
 
-    @validates_schema
+    # start and end are required, the checks below need both of them
+    @validates_schema(skip_on_field_errors=True)
     def validate(self, data, many=None, partial=None):
         if data.get('periodic') is False and data.get('period') is not None:
             raise ValidationError('Either both of period and periodic '
@@ -160,19 +265,45 @@ class EventCreateSchema(DateTimeEventMixin):
                 raise ValidationError('Invalid event borders',
                                       field_names=['start', 'end'])
 
-            event_borders = db_session.query(Event.start, Event.end)\
-                .filter(
-                    Event.user_id == current_identity.id,
-                    Event.end.isnot(None))\
-                .all()
-            for event_start, event_end in event_borders:
-                if max(event_start, start) <= min(event_end, end):
-                    raise ValidationError('Event is overlapping with others')
+            # batch creation checks overlaps for all events at once
+            if not self.context.get('check_overlap', True):
+                return
 
+            overlapping = Event.overlapping(current_identity.id, start, end)
+            if db_session.query(overlapping.exists()).scalar():
+                raise ValidationError('Event is overlapping with others')
 
-# TODO: finish update schema!
-class EventUpdateSchema(EventCreateSchema):
-    id = fields.Integer(required=True)
 
-    def load_object(self, data):
-        return db_session.query(Event).filter(Event.id == data['id']).first()
+class EventUpdateSchema(DateTimeEventMixin):
+    """Partial update of an event, ``version`` is the version the client
+    read and must still be current."""
+    version = fields.Integer(required=True)
+    description = fields.Str()
+    place = fields.Str(allow_none=True)
+    status = fields.Str()
+
+    periodic = fields.Boolean()
+    period = PeriodField(allow_none=True)
+    next_notification = DateTime(allow_none=True)
+    labels = fields.List(fields.Str)
+
+    @validates_schema
+    def validate(self, data, many=None, partial=None):
+        """Checks what can be checked without the stored event, the
+        periodic and period pair is completed by ``update_criteria``."""
+        if data.get('periodic') is False:
+            if data.get('period') is not None:
+                raise ValidationError('Either both of period and periodic '
+                                      'should be specified or none of them',
+                                      field_names=['period', 'periodic'])
+            data['period'] = None
+        if data.get('periodic') is True and 'period' in data and \
+                data['period'] is None:
+            raise ValidationError('Periodic events need a period',
+                                  field_names=['period'])
+        if 'start' in data and 'end' in data and data['start'] > data['end']:
+            raise ValidationError('Invalid event borders',
+                                  field_names=['start', 'end'])
+        if 'start' in data and 'next_notification' not in data:
+            data['next_notification'] = data['start'] - \
+                                        relativedelta(minutes=5)
@@ -0,0 +1,54 @@
+from common.database import db_session
+from .models import EventStatus
+
+
+class UnknownStatus(KeyError):
+    pass
+
+
+class StatusRegistry(object):
+    """In-process copy of the ``event_statuses`` table.
+
+    The table holds a handful of rows that never change at runtime, so it
+    is read once, on first use, and every code to id resolution is served
+    from memory afterwards. ``refresh`` re-reads the table.
+    """
+
+    def __init__(self):
+        self._maps = None
+
+    def load(self, rows):
+        """Replace the registry content with ``(id, code)`` pairs."""
+        rows = list(rows)
+        self._maps = ({code: status_id for status_id, code in rows},
+                      {status_id: code for status_id, code in rows})
+
+    def refresh(self):
+        rows = db_session.query(EventStatus.id, EventStatus.status).all()
+        self.load((status_id, status.code) for status_id, status in rows)
+
+    def clear(self):
+        self._maps = None
+
+    def _get_maps(self):
+        if self._maps is None:
+            self.refresh()
+        return self._maps
+
+    def id_for(self, code):
+        try:
+            return self._get_maps()[0][code]
+        except KeyError:
+            raise UnknownStatus('No status found for key {}'.format(code))
+
+    def code_for(self, status_id):
+        if status_id is None:
+            return None
+        try:
+            return self._get_maps()[1][status_id]
+        except KeyError:
+            raise UnknownStatus('No status found for id {}'
+                                .format(status_id))
+
+
+status_registry = StatusRegistry()
@@ -0,0 +1,54 @@
+from collections import defaultdict
+from itertools import islice
+
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from common.database import db_session
+from .models import EventMedia, Label, LabelsEvents
+
+
+def attach_collections(events):
+    """Load labels and media of ``events`` with one query per collection
+    and store them as already loaded, so that reading them never emits a
+    lazy load."""
+    event_ids = [event.id for event in events]
+
+    labels = defaultdict(list)
+    for event_id, label in db_session\
+            .query(LabelsEvents.c.event_id, Label)\
+            .join(Label, Label.id == LabelsEvents.c.label_id)\
+            .filter(LabelsEvents.c.event_id.in_(event_ids)):
+        labels[event_id].append(label)
+
+    media = defaultdict(list)
+    for item in db_session\
+            .query(EventMedia)\
+            .filter(EventMedia.event_id.in_(event_ids)):
+        media[item.event_id].append(item)
+
+    for event in events:
+        set_committed_value(event, 'labels', labels[event.id])
+        set_committed_value(event, 'media', media[event.id])
+
+
+def iter_event_chunks(query, chunk_size):
+    """Yield events of ``query`` in lists of at most ``chunk_size``.
+
+    Rows are read through a server-side cursor, collections are loaded per
+    chunk and every chunk is expunged once the consumer is done with it, so
+    memory does not grow with the size of the result.
+    """
+    events = iter(query
+                  .options(joinedload('user'))
+                  .yield_per(chunk_size))
+    while True:
+        chunk = list(islice(events, chunk_size))
+        if not chunk:
+            return
+        attach_collections(chunk)
+        yield chunk
+        for event in chunk:
+            for item in event.media:
+                db_session.expunge(item)
+            db_session.expunge(event)
@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+from datetime import datetime
+
+import pytz
+from sqlalchemy import func, select
+
+from common.database import db_session
+from .models import Event
+from .statuses import status_registry
+
+logger = logging.getLogger(__name__)
+
+
+class SweeperMetrics(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.chunks = 0
+        self.moved = 0
+
+    def record(self, moved):
+        self.chunks += 1
+        self.moved += moved
+
+    @property
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.moved / elapsed if elapsed else 0.0
+
+    def to_json(self):
+        return dict(
+            chunks=self.chunks,
+            moved=self.moved,
+            throughput=round(self.throughput, 2)
+        )
+
+
+def sweep_batch(batch_size, now=None, metrics=None):
+    """Move up to ``batch_size`` waiting events that ended before ``now``
+    to passed with one UPDATE, in a transaction of its own.
+
+    The events are picked by a subquery walking ``ix_events_status_id_end``
+    and locked with ``FOR UPDATE SKIP LOCKED``, so rows held by requests or
+    by another sweeper are left for a later chunk instead of waited for.
+    Returns the number of moved events.
+    """
+    now = now or datetime.now(pytz.utc)
+    events = Event.__table__
+    waiting = status_registry.id_for('W')
+    chunk = select([events.c.id])\
+        .where(events.c.status_id == waiting)\
+        .where(events.c.end < now)\
+        .order_by(events.c.end)\
+        .limit(batch_size)\
+        .with_for_update(skip_locked=True)\
+        .correlate(None)
+    statement = events.update()\
+        .where(events.c.id.in_(chunk))\
+        .values(status_id=status_registry.id_for('P'),
+                updated_at=func.now(),
+                version=events.c.version + 1)
+    try:
+        moved = db_session.execute(statement).rowcount
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+    if metrics is not None:
+        metrics.record(moved)
+    return moved
+
+
+def sweep(batch_size, now=None, metrics=None):
+    """Sweep chunk after chunk until a chunk comes back short, returns the
+    number of moved events."""
+    moved = 0
+    while True:
+        chunk = sweep_batch(batch_size, now=now, metrics=metrics)
+        moved += chunk
+        if chunk < batch_size:
+            return moved
+
+
+def run(batch_size, interval, metrics=None):
+    """Sweep every ``interval`` seconds until interrupted, logging the
+    progress after every run."""
+    metrics = metrics or SweeperMetrics()
+    while True:
+        sweep(batch_size, metrics=metrics)
+        logger.info('event sweeper %s', json.dumps(metrics.to_json()))
+        time.sleep(interval)
@@ -0,0 +1,94 @@
+from sqlalchemy import and_, exists, func
+
+from common.database import db_session
+from common.utils import ResponseCodes
+from .models import Event, Label, LabelsEvents, span
+
+EVENT_COLUMNS = ('description', 'place', 'start', 'end', 'periodic',
+                 'period', 'next_notification', 'status_id')
+
+
+def update_criteria(user_id, event_id, version, values):
+    """WHERE clause of the update: the event of ``user_id`` still at
+    ``version``, periodic with a period when ``values`` give only one of
+    them, and, when ``values`` move its borders, still ordered and not
+    overlapping another event of the user."""
+    events = Event.__table__
+    criteria = [events.c.id == event_id,
+                events.c.user_id == user_id,
+                events.c.version == version]
+    # the schema checks periodic and period given together
+    if values.get('periodic') is True and 'period' not in values:
+        criteria.append(events.c.period.isnot(None))
+    if values.get('period') is not None and 'periodic' not in values:
+        criteria.append(events.c.periodic.is_(True))
+    if 'start' not in values and 'end' not in values:
+        return and_(*criteria)
+
+    start = values.get('start', events.c.start)
+    end = values.get('end', events.c.end)
+    if 'start' not in values or 'end' not in values:
+        # the schema compares borders given together
+        criteria.append(start <= end)
+    others = events.alias('others')
+    criteria.append(~exists().where(and_(
+        others.c.user_id == user_id,
+        others.c.id != event_id,
+        others.c.end.isnot(None),
+        span(others.c.start, others.c.end).op('&&')(span(start, end)))))
+    return and_(*criteria)
+
+
+def update_event(user_id, event_id, version, values):
+    """Apply ``values`` to an event with a single UPDATE, the optimistic
+    concurrency and overlap checks are part of its WHERE clause.
+
+    Returns the new version, ``None`` when no row matched, see
+    ``update_failure``. Nothing is committed.
+    """
+    events = Event.__table__
+    statement = events.update()\
+        .where(update_criteria(user_id, event_id, version, values))\
+        .values(dict({column: values[column] for column in EVENT_COLUMNS
+                      if column in values},
+                     updated_at=func.now(),
+                     version=events.c.version + 1))\
+        .returning(events.c.version)
+    return db_session.execute(statement).scalar()
+
+
+def update_failure(user_id, event_id, version, values):
+    """Why ``update_event`` matched no row, as a response code and the
+    data of the error response."""
+    row = db_session.query(Event.user_id, Event.version, Event.start,
+                           Event.end, Event.periodic, Event.period)\
+        .filter(Event.id == event_id)\
+        .first()
+    if row is None or row.user_id != user_id:
+        return ResponseCodes.NOT_FOUND_404, None
+    if row.version != version:
+        return ResponseCodes.CONFLICT_409, {'version': row.version}
+    if values.get('periodic') is True and 'period' not in values and \
+            row.period is None:
+        return ResponseCodes.BAD_REQUEST_400, \
+            {'period': ['Periodic events need a period']}
+    if values.get('period') is not None and 'periodic' not in values and \
+            not row.periodic:
+        return ResponseCodes.BAD_REQUEST_400, \
+            {'periodic': ['Events with a period should be periodic']}
+    if values.get('start', row.start) > values.get('end', row.end):
+        return ResponseCodes.BAD_REQUEST_400, \
+            {'_schema': ['Invalid event borders']}
+    return ResponseCodes.BAD_REQUEST_400, \
+        {'_schema': ['Event is overlapping with others']}
+
+
+def replace_labels(event_id, names):
+    db_session.execute(LabelsEvents.delete()
+                       .where(LabelsEvents.c.event_id == event_id))
+    if names:
+        label_ids = Label.resolve_ids(names)
+        db_session.execute(LabelsEvents.insert().values([
+            dict(event_id=event_id, label_id=label_ids[name])
+            for name in set(names)
+        ]))
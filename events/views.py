@@ -1,21 +1,67 @@
+import codecs
+import json
+from datetime import datetime
+
+import pytz
+
 from flask.blueprints import Blueprint
 from flask_restful import Api
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, subqueryload
 
+from common import json_encoding, warmup
+from common.conditional import (
+    make_etag, not_modified, not_modified_response, validator_headers
+)
 from common.database import db_session
-from common.utils import ResponseCodes, template_response, bytes_to_str
+from common.models import User
+from common.pagination import encode_cursor, keyset_page
+from common.sqlstats import query_budget
+from common.utils import (
+    ResponseCodes, template_response, bytes_to_str, iter_json_envelope
+)
 from common.base import BaseResource
 from events.serializers import (
-    EventSchema, EventCreateSchema, EventUpdateSchema
+    EventCreateSchema, EventUpdateSchema, EventListArgsSchema,
+    EventExportArgsSchema, EventSearchArgsSchema, OccurrencesArgsSchema,
+    LabelFacetSchema, OccurrenceSchema,
+    dump_event, dump_events, encode_event_cursor
 )
 
+from .bulk import insert_events, validate_batch
+from .export import FORMATS as EXPORT_FORMATS, iter_gzip, iter_ical, \
+    iter_ndjson
+from .importer import FORMATS, import_events
+from .list_cache import invalidate as invalidate_list_cache, list_cache
 from .models import Event
+from .occurrences import expand, invalidate as invalidate_occurrences
+from .statuses import UnknownStatus, status_registry
+from .streaming import iter_event_chunks
+from .updates import replace_labels, update_event, update_failure
 
 from flask_jwt import jwt_required, current_identity
-from flask import request
+from flask import Response, current_app, request, stream_with_context
 
 
 api_bp = Blueprint('events', __name__)
 api = Api(api_bp)
+json_encoding.register(api)
+
+# Relationships read by EventSchema are loaded up front so that dumping
+# events never falls back to per-row lazy loads. Statuses are resolved
+# through status_registry and need no loading. A single event is fetched
+# with one joined query; lists load collections with one extra query each
+# instead of multiplying rows by labels and media.
+EVENT_DETAIL_OPTIONS = (
+    joinedload('user'),
+    joinedload('labels'),
+    joinedload('media'),
+)
+EVENT_LIST_OPTIONS = (
+    joinedload('user'),
+    subqueryload('labels'),
+    subqueryload('media'),
+)
 
 
 class EventBase(BaseResource):
@@ -28,46 +74,245 @@ class EventBase(BaseResource):
 
 
 class EventDetail(EventBase):
+    @staticmethod
+    def validators(user_id, event_id):
+        """ETag and Last-Modified of the event, ``None`` when ``user_id``
+        has no such event. Reads only versions and timestamps, so a
+        conditional request that matches never loads the event."""
+        row = db_session.query(Event.version, Event.updated_at,
+                               User.version, User.updated_at)\
+            .join(User, Event.user_id == User.id)\
+            .filter(Event.id == event_id, Event.user_id == user_id)\
+            .first()
+        if row is None:
+            return None
+        version, updated_at, user_version, user_updated_at = row
+        return make_etag('event', event_id, version, user_version), \
+            max(updated_at, user_updated_at)
+
+    @query_budget(3)
     @jwt_required()
     def get(self, event_id):
-        event = db_session.query(Event).filter(Event.id == event_id).first()
+        validators = self.validators(current_identity.id, event_id)
+        if validators is None:
+            return self._not_found()
+        etag, last_modified = validators
+        if not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        event = db_session.query(Event)\
+            .options(*EVENT_DETAIL_OPTIONS)\
+            .filter(Event.id == event_id)\
+            .first()
         if not event or event.user_id != current_identity.id:
             return self._not_found()
-        return template_response(
+        body, code = template_response(
             status='OK',
             code=ResponseCodes.OK,
-            data=EventSchema().dump(event).data
+            data=dump_event(event)
         )
+        return body, code, validator_headers(etag, last_modified)
 
 
 class EventUpdate(EventBase):
+    @query_budget(6)
     @jwt_required()
-    def patch(self):
-        schema = EventUpdateSchema(partial=True)
-        data, errors = schema.loads(bytes_to_str(request.data))
+    def patch(self, event_id):
+        data, errors = EventUpdateSchema().loads(bytes_to_str(request.data))
         if errors:
             return self._bad_request(errors)
 
-        # TODO: handle logic here
-        db_session.query(Event).filter(data.id)
+        version, labels = data.pop('version'), data.pop('labels', None)
+        if 'status' in data:
+            try:
+                data['status_id'] = status_registry.id_for(data.pop('status'))
+            except UnknownStatus:
+                return self._bad_request({'status': ['Unknown status']})
+        if not data and labels is None:
+            return self._bad_request({'_schema': ['Nothing to update']})
 
+        user_id = current_identity.id
+        new_version = update_event(user_id, event_id, version, data)
+        if new_version is None:
+            code, errors = update_failure(user_id, event_id, version, data)
+            db_session.rollback()
+            if code == ResponseCodes.NOT_FOUND_404:
+                return self._not_found()
+            return template_response(status='Error', code=code, data=errors)
+        if labels is not None:
+            replace_labels(event_id, labels)
+        db_session.commit()
+
+        # the UPDATE bypasses the mapper events invalidating these
+        invalidate_occurrences(event_id)
+        invalidate_list_cache(user_id)
+        return template_response(
+            status='OK',
+            message='Updated',
+            data=dict(id=event_id, version=new_version),
+            code=ResponseCodes.OK
+        )
+
+
+class EventList(EventBase):
+    key_columns = (Event.start, Event.id)
+
+    @staticmethod
+    def validators(user_id):
+        """ETag and Last-Modified of the events of ``user_id``, read with
+        one aggregate covered by ``ix_events_user_id_updated_at_version``.
+
+        Any insert, update or delete changes the count, the latest
+        ``updated_at`` or the sum of versions. Only the ETag notices deletes,
+        so it is preferred over Last-Modified.
+        """
+        count, updated_at, versions, user_version, user_updated_at = \
+            db_session.query(func.count(Event.id),
+                             func.max(Event.updated_at),
+                             func.sum(Event.version),
+                             User.version,
+                             User.updated_at)\
+            .select_from(User)\
+            .outerjoin(Event, Event.user_id == User.id)\
+            .filter(User.id == user_id)\
+            .group_by(User.id)\
+            .one()
+        etag = make_etag('events', count, updated_at, versions, user_version,
+                         request.query_string.decode('utf-8'))
+        return etag, max(filter(None, (updated_at, user_updated_at)))
+
+    @query_budget(5, per_chunk=2)
+    @jwt_required()
+    def get(self):
+        args, errors = EventListArgsSchema().load(request.args)
         if errors:
             return self._bad_request(errors)
 
+        etag, last_modified = self.validators(current_identity.id)
+        if not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        headers = validator_headers(etag, last_modified)
+        cache = current_app.config['EVENTS_LIST_CACHE'] and not args['all']
+        if cache:
+            cached = list_cache.get(current_identity.id, etag)
+            if cached is not None:
+                return json_encoding.PreEncoded(cached), ResponseCodes.OK, \
+                    headers
 
-class EventList(EventBase):
+        query = db_session.query(Event)\
+            .filter(Event.user_id == current_identity.id)
+        if args.get('window_start') or args.get('window_end'):
+            query = query.filter(Event.in_window(args.get('window_start'),
+                                                 args.get('window_end')))
+        if args.get('labels'):
+            query = query.filter(Event.labelled(
+                args['labels'], match_all=args['labels_match'] == 'all'))
+
+        if args['all']:
+            response = self._stream(query.order_by(*self.key_columns))
+            response.headers.extend(headers)
+            return response
+
+        events, has_more = keyset_page(query.options(*EVENT_LIST_OPTIONS),
+                                       self.key_columns,
+                                       limit=args['limit'],
+                                       after=args.get('cursor'))
+        next_cursor = encode_event_cursor(events[-1]) if has_more else None
+        body, code = template_response(
+            status='OK',
+            code=ResponseCodes.OK,
+            data=dump_events(events),
+            next=next_cursor
+        )
+        if cache:
+            body = json_encoding.PreEncoded(json_encoding.dumps(body))
+            list_cache.set(current_identity.id, etag, body)
+        return body, code, headers
+
+    def _stream(self, query):
+        chunks = (dump_events(events)
+                  for events in iter_event_chunks(
+                      query, current_app.config['EVENTS_STREAM_CHUNK_SIZE']))
+        return Response(
+            stream_with_context(iter_json_envelope(chunks,
+                                                   status='OK',
+                                                   code=ResponseCodes.OK)),
+            mimetype='application/json'
+        )
+
+
+class EventSearch(EventBase):
+    @query_budget(4)
+    @jwt_required()
+    def get(self):
+        args, errors = EventSearchArgsSchema().load(request.args)
+        if errors:
+            return self._bad_request(errors)
+
+        matches, rank = Event.matching(args['q'])
+        # best matches first, the keyset runs over (-rank, id) ascending
+        after = args.get('cursor')
+        if after is not None:
+            after = -after[0], after[1]
+        rows, has_more = keyset_page(
+            db_session.query(Event, rank)
+            .select_from(Event)
+            .options(*EVENT_LIST_OPTIONS)
+            .filter(Event.user_id == current_identity.id, matches),
+            (-rank, Event.id),
+            limit=args['limit'],
+            after=after)
+        next_cursor = None
+        if has_more:
+            last, last_rank = rows[-1]
+            next_cursor = encode_cursor([last_rank, last.id])
+        return template_response(
+            status='OK',
+            code=ResponseCodes.OK,
+            data=dump_events([event for event, _ in rows]),
+            next=next_cursor
+        )
+
+
+class EventLabelFacets(EventBase):
+    @query_budget(2)
     @jwt_required()
     def get(self):
-        query = db_session.query(Event).filter(
-            Event.user_id == current_identity.id).all()
+        facets = [dict(name=name, count=count) for name, count in
+                  Event.label_counts(current_identity.id)]
         return template_response(
             status='OK',
             code=ResponseCodes.OK,
-            data=EventSchema().dump(query, many=True).data
+            data=LabelFacetSchema().dump(facets, many=True).data
+        )
+
+
+class EventOccurrences(EventBase):
+    @query_budget(2)
+    @jwt_required()
+    def get(self):
+        args, errors = OccurrencesArgsSchema().load(request.args)
+        if errors:
+            return self._bad_request(errors)
+
+        window_start, window_end = args['window_start'], args['window_end']
+        events = db_session.query(Event)\
+            .filter(Event.user_id == current_identity.id,
+                    Event.in_window(window_start, window_end))\
+            .all()
+
+        occurrences = [dict(event_id=event.id, start=start)
+                       for event, start in expand(events, window_start,
+                                                  window_end, args['limit'])]
+        return template_response(
+            status='OK',
+            code=ResponseCodes.OK,
+            data=OccurrenceSchema().dump(occurrences, many=True).data
         )
 
 
 class EventCreate(EventBase):
+    @query_budget(5)
     @jwt_required()
     def post(self):
         # create an object instance
@@ -84,14 +329,159 @@ class EventCreate(EventBase):
         return template_response(
                 status='OK',
                 message='Created',
-                data=EventSchema().dump(event).data,
+                data=dump_event(event),
                 code=ResponseCodes.CREATED
         )
 
 
+class EventBulkCreate(EventBase):
+    @query_budget(6)
+    @jwt_required()
+    def post(self):
+        try:
+            payload = json.loads(bytes_to_str(request.data))
+        except ValueError:
+            payload = None
+        max_size = current_app.config['EVENTS_BULK_MAX_SIZE']
+        if not isinstance(payload, list) or not 0 < len(payload) <= max_size:
+            return self._bad_request(
+                {'_schema': ['Expected a list of 1 to {} events'
+                             .format(max_size)]})
+
+        schema = EventCreateSchema(context={'check_overlap': False})
+        items, errors = {}, {}
+        for index, item in enumerate(payload):
+            if not isinstance(item, dict):
+                errors[index] = {'_schema': ['Invalid event']}
+                continue
+            data, item_errors = schema.load(item)
+            if item_errors:
+                errors[index] = item_errors
+            else:
+                items[index] = data
+
+        items, batch_errors = validate_batch(current_identity.id, items)
+        errors.update(batch_errors)
+        ids = insert_events(current_identity.id, items) if items else {}
+        db_session.commit()
+        invalidate_list_cache(current_identity.id)
+
+        results = [dict(index=index, id=ids[index]) if index in ids
+                   else dict(index=index, errors=errors[index])
+                   for index in range(len(payload))]
+        if not ids:
+            return self._bad_request(results)
+        return template_response(
+            status='OK',
+            message='Created {} of {}'.format(len(ids), len(payload)),
+            data=results,
+            code=ResponseCodes.CREATED
+        )
+
+
+class EventImport(EventBase):
+    content_types = {
+        'application/x-ndjson': 'ndjson',
+        'text/csv': 'csv',
+    }
+
+    @query_budget(9)
+    @jwt_required()
+    def post(self):
+        fmt = request.args.get('format') or \
+            self.content_types.get(request.mimetype)
+        if fmt not in FORMATS:
+            return self._bad_request(
+                {'format': ['Expected one of {}'.format(', '.join(FORMATS))]})
+
+        lines = codecs.getreader('utf-8')(request.stream)
+        report = import_events(
+            current_identity.id, lines, fmt,
+            max_errors=current_app.config['IMPORT_MAX_REPORTED_ERRORS'])
+        invalidate_list_cache(current_identity.id)
+        imported = report.imported > 0
+        return template_response(
+            status='OK' if imported else 'Error',
+            message='Imported {} of {}'.format(report.imported, report.read),
+            data=report.to_json(),
+            code=ResponseCodes.CREATED if imported
+            else ResponseCodes.UNPROCESSABLE_ENTITY_422
+        )
+
+
+class EventExport(EventBase):
+    @query_budget(2, per_chunk=2)
+    @jwt_required()
+    def get(self):
+        args, errors = EventExportArgsSchema().load(request.args)
+        if errors:
+            return self._bad_request(errors)
+
+        query = db_session.query(Event)\
+            .filter(Event.user_id == current_identity.id)
+        if args.get('window_start') or args.get('window_end'):
+            query = query.filter(Event.in_window(args.get('window_start'),
+                                                 args.get('window_end')))
+
+        chunks = iter_event_chunks(
+            query.order_by(Event.start, Event.id),
+            current_app.config['EVENTS_STREAM_CHUNK_SIZE'])
+        if args['format'] == 'ics':
+            pieces = iter_ical(chunks,
+                               stamp=datetime.now(pytz.utc),
+                               domain=current_app.config['EXPORT_ICAL_DOMAIN'])
+        else:
+            pieces = iter_ndjson(chunks, dump_event)
+
+        mimetype, extension = EXPORT_FORMATS[args['format']]
+        headers = {
+            'Content-Disposition':
+                'attachment; filename="events.{}"'.format(extension),
+            'Vary': 'Accept-Encoding',
+        }
+        if request.accept_encodings['gzip']:
+            pieces = iter_gzip(pieces,
+                               level=current_app.config['EXPORT_GZIP_LEVEL'])
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(pieces),
+                        mimetype=mimetype,
+                        headers=headers)
+
+
+def _hot_statements():
+    now = datetime.now(pytz.utc)
+    yield db_session.query(Event)\
+        .options(*EVENT_DETAIL_OPTIONS)\
+        .filter(Event.id == 0)\
+        .with_labels()\
+        .statement
+    yield db_session.query(Event)\
+        .options(*EVENT_LIST_OPTIONS)\
+        .filter(Event.user_id == 0, Event.in_window(now, now))\
+        .order_by(*EventList.key_columns)\
+        .limit(1)\
+        .with_labels()\
+        .statement
+    yield db_session.query(Event.overlapping(0, now, now).exists())\
+        .statement
+
+
+warmup.register_statements(_hot_statements)
+warmup.register_step(status_registry.refresh)
+
+
 api.add_resource(EventDetail, '/events/event/<int:event_id>',
                  endpoint='detail')
 api.add_resource(EventUpdate, '/events/event/<int:event_id>',
                  endpoint='update')
 api.add_resource(EventCreate, '/events/event/', endpoint='create')
+api.add_resource(EventBulkCreate, '/events/event/bulk/',
+                 endpoint='bulk_create')
+api.add_resource(EventImport, '/events/event/import/', endpoint='import')
+api.add_resource(EventExport, '/events/event/export/', endpoint='export')
 api.add_resource(EventList, '/events/event/list/', endpoint='list')
+api.add_resource(EventLabelFacets, '/events/labels/facets/',
+                 endpoint='label_facets')
+api.add_resource(EventSearch, '/events/search/', endpoint='search')
+api.add_resource(EventOccurrences, '/events/occurrences/',
+                 endpoint='occurrences')
@@ -0,0 +1,42 @@
+import argparse
+import json
+import logging
+import sys
+
+from common import create_app
+from common.database import db_session
+from common.models import User
+from events.importer import FORMATS, import_events
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Import events of a user from NDJSON or CSV.')
+    parser.add_argument('username')
+    parser.add_argument('source', type=argparse.FileType('r'),
+                        help="file to import, '-' reads standard input")
+    parser.add_argument('--format', choices=FORMATS,
+                        help='defaults to the extension of the file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    fmt = args.format or args.source.name.rsplit('.', 1)[-1]
+    if fmt not in FORMATS:
+        sys.exit('Unknown format, use --format')
+
+    app = create_app()
+    with app.app_context():
+        user_id = db_session.query(User.id)\
+            .filter(User.username == args.username)\
+            .scalar()
+        if user_id is None:
+            sys.exit('No user {}'.format(args.username))
+
+        report = import_events(
+            user_id, args.source, fmt,
+            max_errors=app.config['IMPORT_MAX_REPORTED_ERRORS'])
+    print(json.dumps(report.to_json(), indent=4))
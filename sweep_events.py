@@ -0,0 +1,31 @@
+import argparse
+import json
+import logging
+
+from common import create_app
+from events.sweeper import SweeperMetrics, run, sweep
+
+
+def parse_args(app):
+    parser = argparse.ArgumentParser(
+        description='Move waiting events that ended to passed.')
+    parser.add_argument('--batch-size', type=int,
+                        default=app.config['SWEEPER_BATCH_SIZE'])
+    parser.add_argument('--interval', type=float,
+                        default=app.config['SWEEPER_INTERVAL'])
+    parser.add_argument('--once', action='store_true',
+                        help='sweep once and exit')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    args = parse_args(app)
+    with app.app_context():
+        if args.once:
+            metrics = SweeperMetrics()
+            sweep(args.batch_size, metrics=metrics)
+            print(json.dumps(metrics.to_json()))
+        else:
+            run(batch_size=args.batch_size, interval=args.interval)
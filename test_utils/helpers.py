@@ -1,6 +1,6 @@
 import json
 from collections import Counter
-from common import app
+from app import app
 from flask import url_for
 
 from common.utils import ResponseCodes, get_json
@@ -1,4 +1,9 @@
+import gzip
 import json
+import sys
+import threading
+import types
+from collections import Counter
 import factory
 import pytz
 from datetime import datetime, timedelta
@@ -7,11 +12,27 @@ from factory import fuzzy
 from flask.helpers import url_for
 from random import randint
 
-from common import app
+import pytest
+
+from app import app
+from common.cache import LRUCache
+from common.sqlstats import count_statements
 from common.utils import ResponseCodes, get_json
 from marshmallow import Schema, fields
 
-from events.serializers import PeriodField
+from events.bulk import Interval, find_overlaps
+from events.export import fold
+from events.list_cache import configure as configure_list_cache, \
+    list_cache
+from common.models import User
+from common.response_cache import LocalBackend, ResponseCache
+from events.models import Event, EventMedia, EventStatus, Label
+from events.notifications import InMemorySink, dispatch_batch
+from events.occurrences import expand, iter_occurrences, occurrence_cache
+from events.serializers import EventSchema, PeriodField, dump_event, \
+    dump_events
+from events.statuses import UnknownStatus, status_registry
+from events.sweeper import SweeperMetrics, sweep, sweep_batch
 from test_utils.helpers import get_auth_header, register_and_login_user, \
     JSON_CONTENT_TYPE, dict_contains_subset
 
@@ -26,6 +47,10 @@ def get_timezone_aware_time():
 with app.test_request_context():
     CREATE_URL = url_for('events.create')
     LIST_URL = url_for('events.list')
+    OCCURRENCES_URL = url_for('events.occurrences')
+    BULK_CREATE_URL = url_for('events.bulk_create')
+    IMPORT_URL = url_for('events.import')
+    EXPORT_URL = url_for('events.export')
 
 
 def get_detail_url(event_id):
@@ -99,6 +124,13 @@ class PeriodicEventPayloadFactory(EventPayloadFactory):
         return self.start + self.period
 
 
+def sequential_event_payloads(count, factory=NonPeriodicEventFactory):
+    start = get_timezone_aware_time() + relativedelta(days=1)
+    return [factory(start=start + relativedelta(days=i),
+                    end=start + relativedelta(days=i, hours=1))
+            for i in range(count)]
+
+
 def create_event(test_client, token,
                  event_payload=None,
                  event_payload_factory=PeriodicEventPayloadFactory,
@@ -204,3 +236,1035 @@ def test_create_overlapping_events(test_client, transaction):
     data = get_json(response, inner_data=True)
     # Schema level error
     assert '_schema' in data
+
+
+def test_create_adjacent_events(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+
+    event_payload = NonPeriodicEventFactory()
+    next_start = event_payload['end'] + relativedelta(seconds=1)
+    event2_payload = NonPeriodicEventFactory(
+        start=next_start, end=next_start + relativedelta(hours=1))
+
+    create_event(test_client, token, event_payload=event_payload)
+    create_event(test_client, token, event_payload=event2_payload)
+
+
+def patch_event(test_client, token, event_id, **changes):
+    response = test_client.patch(get_detail_url(event_id),
+                                 data=json.dumps(changes),
+                                 headers=dict(JSON_CONTENT_TYPE,
+                                              **get_auth_header(token)))
+    return response, get_json(response)
+
+
+def test_update_event(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    data = create_event(test_client, token,
+                        event_payload_factory=EventPayloadFactory)[1]
+    get_list(test_client, token)
+
+    with count_statements() as statements:
+        response, body = patch_event(test_client, token, data['id'],
+                                     version=1, description='moved',
+                                     place='elsewhere')
+    assert response.status_code == ResponseCodes.OK
+    assert body['data'] == dict(id=data['id'], version=2)
+    assert statements.count == 1
+
+    response, body = get_list(test_client, token)
+    event, = body['data']
+    assert (event['description'], event['place'], event['version']) == \
+        ('moved', 'elsewhere', 2)
+
+    response, body = patch_event(test_client, token, data['id'],
+                                 version=1, labels=['a', 'b'])
+    assert response.status_code == ResponseCodes.CONFLICT_409
+    assert body['data'] == dict(version=2)
+
+    response, body = patch_event(test_client, token, data['id'],
+                                 version=2, labels=['a', 'b'],
+                                 status='P')
+    assert response.status_code == ResponseCodes.OK
+    event = get_json(test_client.get(
+        get_detail_url(data['id']),
+        headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token))),
+        inner_data=True)
+    assert sorted(event['labels']) == ['a', 'b']
+    assert (event['status'], event['version']) == ('P', 3)
+
+
+def test_update_event_periodic(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payload = sequential_event_payloads(1, factory=NonPeriodicEventFactory)[0]
+    event_id = create_event(test_client, token,
+                            event_payload=payload)[1]['id']
+
+    def detail():
+        return get_json(test_client.get(
+            get_detail_url(event_id),
+            headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token))),
+            inner_data=True)
+
+    response, body = patch_event(test_client, token, event_id, version=1,
+                                 periodic=True)
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert 'period' in body['data']
+    response, body = patch_event(test_client, token, event_id, version=1,
+                                 period='1 0:0:0')
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert 'periodic' in body['data']
+
+    response, body = patch_event(test_client, token, event_id, version=1,
+                                 periodic=True, period='1 0:0:0')
+    assert response.status_code == ResponseCodes.OK
+    assert (detail()['periodic'], detail()['period']) == (True, '1 0:0:0')
+
+    response, body = patch_event(test_client, token, event_id, version=2,
+                                 periodic=False)
+    assert response.status_code == ResponseCodes.OK
+    assert (detail()['periodic'], detail()['period']) == (False, None)
+
+    # an explicit null is kept, only a missing one follows the start
+    response, body = patch_event(
+        test_client, token, event_id, version=3, next_notification=None,
+        start=(payload['start'] + relativedelta(minutes=1))
+        .strftime(DATETIME_FORMAT))
+    assert response.status_code == ResponseCodes.OK
+    assert detail()['next_notification'] is None
+
+
+def test_update_event_borders(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    first, second = sequential_event_payloads(2)
+    first_id = create_event(test_client, token, event_payload=first)[1]['id']
+    create_event(test_client, token, event_payload=second)
+
+    response, body = patch_event(
+        test_client, token, first_id, version=1,
+        end=second['start'].strftime(DATETIME_FORMAT))
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert body['data'] == {'_schema': ['Event is overlapping with others']}
+
+    response, body = patch_event(
+        test_client, token, first_id, version=1,
+        end=(first['start'] - relativedelta(hours=1))
+        .strftime(DATETIME_FORMAT))
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert body['data'] == {'_schema': ['Invalid event borders']}
+
+    # moving the event inside its own old span is no overlap
+    response, body = patch_event(
+        test_client, token, first_id, version=1,
+        end=(first['end'] - relativedelta(minutes=30))
+        .strftime(DATETIME_FORMAT))
+    assert response.status_code == ResponseCodes.OK
+
+
+def test_update_event_of_other_user(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    event_id = create_event(test_client, token)[1]['id']
+    other_payload, other_token = register_and_login_user(test_client)
+
+    response, body = patch_event(test_client, other_token, event_id,
+                                 version=1, description='mine')
+    assert response.status_code == ResponseCodes.NOT_FOUND_404
+    response, body = patch_event(test_client, token, event_id, version=1)
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+
+def get_list(test_client, token, **params):
+    response = test_client.get(LIST_URL,
+                               query_string=params,
+                               headers=dict(JSON_CONTENT_TYPE,
+                                            **get_auth_header(token)))
+    return response, get_json(response)
+
+
+def test_event_list_pagination(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    created_ids = [create_event(test_client, token, event_payload=payload)[1]
+                   ['id'] for payload in sequential_event_payloads(5)]
+
+    listed_ids, cursor = [], None
+    for page in range(3):
+        params = dict(limit=2, cursor=cursor) if cursor else dict(limit=2)
+        response, body = get_list(test_client, token, **params)
+        assert response.status_code == ResponseCodes.OK
+        assert len(body['data']) <= 2
+        listed_ids.extend(event['id'] for event in body['data'])
+        cursor = body['next']
+
+    assert cursor is None
+    assert listed_ids == created_ids
+
+
+def test_event_list_all(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    for payload in sequential_event_payloads(3):
+        create_event(test_client, token, event_payload=payload)
+
+    response, body = get_list(test_client, token, limit=1, all='true')
+    assert response.status_code == ResponseCodes.OK
+    assert len(body['data']) == 3
+    assert 'next' not in body
+
+
+def test_event_list_label_filters(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(3)
+    for payload, labels in zip(payloads, (['a', 'b'], ['a'], ['c'])):
+        payload['labels'] = labels
+    ids = [create_event(test_client, token, event_payload=payload)[1]['id']
+           for payload in payloads]
+    other_payload, other_token = register_and_login_user(test_client)
+    create_event(test_client, other_token, event_payload=dict(
+        payloads[0], labels=['a']))
+
+    for params, expected in ((dict(labels='a'), ids[:2]),
+                             (dict(labels='a, c'), ids),
+                             (dict(labels='a,b', labels_match='all'),
+                              ids[:1]),
+                             (dict(labels='b,c', labels_match='all'), []),
+                             (dict(labels='b,c', all='true'), ids[::2])):
+        response, body = get_list(test_client, token, **params)
+        assert response.status_code == ResponseCodes.OK
+        assert [event['id'] for event in body['data']] == expected
+
+    for params in (dict(labels=','), dict(labels='a', labels_match='some')):
+        response, body = get_list(test_client, token, **params)
+        assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+    with app.test_request_context():
+        url = url_for('events.label_facets')
+    with count_statements() as statements:
+        response = test_client.get(url, headers=dict(
+            JSON_CONTENT_TYPE, **get_auth_header(token)))
+    assert statements.count == 1
+    assert get_json(response, inner_data=True) == [
+        dict(name='a', count=2), dict(name='b', count=1),
+        dict(name='c', count=1)]
+
+
+def test_event_list_invalid_cursor(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+
+    response, body = get_list(test_client, token, cursor='not a cursor')
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert 'cursor' in body['data']
+
+
+def test_event_detail_not_modified(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    data = create_event(test_client, token)[1]
+    headers = dict(JSON_CONTENT_TYPE, **get_auth_header(token))
+
+    response = test_client.get(get_detail_url(data['id']), headers=headers)
+    assert response.status_code == ResponseCodes.OK
+    assert get_json(response, inner_data=True)['version'] == 1
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    for conditional in ({'If-None-Match': etag},
+                        {'If-Modified-Since': last_modified}):
+        with count_statements() as statements:
+            response = test_client.get(get_detail_url(data['id']),
+                                       headers=dict(headers, **conditional))
+        assert response.status_code == 304
+        # only the validators are read
+        assert statements.count == 1
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+
+    response = test_client.get(get_detail_url(data['id']),
+                               headers=dict(headers, **{
+                                   'If-None-Match': 'W/"stale"',
+                                   'If-Modified-Since': last_modified}))
+    assert response.status_code == ResponseCodes.OK
+
+
+def test_event_list_not_modified(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(2)
+    create_event(test_client, token, event_payload=payloads[0])
+    headers = dict(JSON_CONTENT_TYPE, **get_auth_header(token))
+
+    response = test_client.get(LIST_URL, headers=headers)
+    assert response.status_code == ResponseCodes.OK
+    etag = response.headers['ETag']
+
+    with count_statements() as statements:
+        response = test_client.get(
+            LIST_URL, headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert statements.count == 1
+
+    # another page of the same events is another representation
+    response = test_client.get(
+        LIST_URL, query_string=dict(limit=1),
+        headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == ResponseCodes.OK
+
+    create_event(test_client, token, event_payload=payloads[1])
+    response = test_client.get(
+        LIST_URL, headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == ResponseCodes.OK
+    assert len(get_json(response, inner_data=True)) == 2
+    assert response.headers['ETag'] != etag
+
+
+class FakeRedis(object):
+    """The part of the redis client RedisBackend uses."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hget(self, name, key):
+        return self.hashes.get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    def expire(self, name, ttl):
+        pass
+
+    def delete(self, name):
+        self.hashes.pop(name, None)
+
+    def pipeline(self):
+        client = self
+
+        class Pipeline(object):
+            def __getattr__(self, name):
+                return getattr(client, name)
+
+            def execute(self):
+                pass
+        return Pipeline()
+
+    def scan_iter(self, pattern):
+        return [name for name in list(self.hashes)
+                if name.startswith(pattern.rstrip('*'))]
+
+    def info(self, section):
+        return {'used_memory': 0}
+
+
+@pytest.fixture(params=[None, 'redis://localhost/0'],
+                ids=['local', 'redis'])
+def configured_list_cache(request, monkeypatch):
+    """The list cache configured with EVENTS_LIST_CACHE_REDIS_URL unset and
+    set, the redis client replaced by FakeRedis. Restores the app's."""
+    redis = types.ModuleType('redis')
+    redis.StrictRedis = type('StrictRedis', (object,), {
+        'from_url': staticmethod(lambda url: FakeRedis())})
+    monkeypatch.setitem(sys.modules, 'redis', redis)
+    config = dict(app.config, EVENTS_LIST_CACHE_REDIS_URL=request.param)
+    try:
+        configure_list_cache(config)
+        yield list_cache
+    finally:
+        configure_list_cache(app.config)
+
+
+def test_event_list_cache(test_client, transaction, configured_list_cache):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(2)
+    create_event(test_client, token, event_payload=payloads[0])
+
+    response, body = get_list(test_client, token)
+    with count_statements() as statements:
+        cached_response, cached_body = get_list(test_client, token)
+    assert statements.count == 1
+    assert cached_response.data == response.data
+    assert configured_list_cache.stats()['hits'] == 1
+
+    create_event(test_client, token, event_payload=payloads[1])
+    response, body = get_list(test_client, token)
+    assert len(body['data']) == 2
+    assert configured_list_cache.stats()['misses'] == 2
+
+
+def test_local_response_cache_bounds():
+    backend = LocalBackend(maxsize=3, maxbytes=10)
+    for key in range(3):
+        backend.set(1, key, b'abc')
+    backend.set(2, 0, b'abcd')
+    assert backend.get(1, 0) is None
+    assert backend.stats()['bytes'] == 10
+    assert backend.stats()['evictions'] == 1
+    backend.set(2, 1, b'a' * 11)
+    assert backend.get(2, 1) is None
+    backend.invalidate(1)
+    assert len(backend) == 1 and backend.nbytes == 4
+
+
+def test_response_cache_counts_under_threads():
+    cache = ResponseCache(LocalBackend())
+    cache.set(1, 'hit', b'abc')
+
+    def lookup():
+        for _ in range(2000):
+            cache.get(1, 'hit')
+            cache.get(1, 'miss')
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (16000, 16000)
+
+
+def test_event_list_query_count_is_constant(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(6, factory=EventPayloadFactory)
+
+    query_counts = []
+    for batch in (payloads[:2], payloads[2:]):
+        for payload in batch:
+            create_event(test_client, token, event_payload=payload)
+        for params in (dict(all='true'), dict(limit=10)):
+            with count_statements() as statements:
+                response, body = get_list(test_client, token, **params)
+            assert response.status_code == ResponseCodes.OK
+            query_counts.append(statements.count)
+
+    assert query_counts[:2] == query_counts[2:]
+
+
+def test_event_list_all_is_streamed_in_chunks(test_client, transaction,
+                                              monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_STREAM_CHUNK_SIZE', 2)
+    user_payload, token = register_and_login_user(test_client)
+    created = [create_event(test_client, token, event_payload=payload)[1]
+               for payload in sequential_event_payloads(
+                   5, factory=EventPayloadFactory)]
+
+    response = test_client.get(LIST_URL, query_string=dict(all='true'),
+                               headers=dict(JSON_CONTENT_TYPE,
+                                            **get_auth_header(token)),
+                               buffered=False)
+    assert response.status_code == ResponseCodes.OK
+    assert response.is_streamed
+    pieces = list(response.response)
+    # every chunk of events is sent as a piece of its own
+    assert sum(b'"id"' in piece for piece in pieces) == 3
+
+    body = json.loads(b''.join(pieces).decode('utf-8'))
+    assert body['status'] == 'OK'
+    assert [e['id'] for e in body['data']] == [e['id'] for e in created]
+    for streamed, event in zip(body['data'], created):
+        assert Counter(streamed['labels']) == Counter(event['labels'])
+
+
+def test_event_list_window(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(3)
+    created_ids = [create_event(test_client, token, event_payload=payload)[1]
+                   ['id'] for payload in payloads]
+
+    def listed_ids(**window):
+        params = {key: value.strftime(DATETIME_FORMAT)
+                  for key, value in window.items()}
+        response, body = get_list(test_client, token, **params)
+        assert response.status_code == ResponseCodes.OK
+        return [event['id'] for event in body['data']]
+
+    second = payloads[1]
+    assert listed_ids(**{'from': second['start'],
+                         'to': second['end']}) == created_ids[1:2]
+    assert listed_ids(**{'from': second['start']}) == created_ids[1:]
+    assert listed_ids(to=second['start']) == created_ids[:1]
+
+
+def test_event_list_invalid_window(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    now = get_timezone_aware_time()
+
+    response, body = get_list(test_client, token, **{
+        'from': now.strftime(DATETIME_FORMAT),
+        'to': (now - relativedelta(days=1)).strftime(DATETIME_FORMAT)
+    })
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+    assert 'from' in body['data']
+
+
+def daily_event_payload(days):
+    start = get_timezone_aware_time().replace(microsecond=0) + \
+        relativedelta(days=1)
+    return PeriodicEventPayloadFactory(
+        start=start,
+        end=start + relativedelta(days=days - 1, hours=1),
+        period=timedelta(days=1),
+        next_notification=start)
+
+
+def search_events(test_client, token, **params):
+    with app.test_request_context():
+        url = url_for('events.search')
+    response = test_client.get(url, query_string=params,
+                               headers=dict(JSON_CONTENT_TYPE,
+                                            **get_auth_header(token)))
+    return response, get_json(response)
+
+
+def test_search_events(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(3, factory=NonPeriodicEventFactory)
+    for payload, description in zip(payloads, ('team meeting',
+                                               'meeting after meeting',
+                                               'lunch')):
+        payload['description'] = description
+    team_id, double_id, lunch_id = [
+        create_event(test_client, token, event_payload=payload)[1]['id']
+        for payload in payloads]
+    other_payload, other_token = register_and_login_user(test_client)
+    create_event(test_client, other_token, event_payload=payloads[0])
+
+    found, cursor = [], None
+    for page in range(2):
+        params = dict(q='Meeting', limit=1)
+        if cursor:
+            params['cursor'] = cursor
+        response, body = search_events(test_client, token, **params)
+        assert response.status_code == ResponseCodes.OK
+        found.extend(event['id'] for event in body['data'])
+        cursor = body['next']
+    assert found == [double_id, team_id]
+    assert cursor is None
+
+    # the search document follows updates of the place
+    patch_event(test_client, token, lunch_id, version=1, place='Library')
+    response, body = search_events(test_client, token, q='library -team')
+    assert [event['id'] for event in body['data']] == [lunch_id]
+
+
+def test_search_events_invalid_args(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    for params in (dict(), dict(q=''), dict(q='a', cursor='not a cursor')):
+        response, body = search_events(test_client, token, **params)
+        assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+
+def test_event_occurrences(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payload = daily_event_payload(days=10)
+    event_id = create_event(test_client, token, event_payload=payload)[1]['id']
+
+    window_start = payload['start'] + relativedelta(days=2, hours=-1)
+    window_end = window_start + relativedelta(days=3)
+    response = test_client.get(
+        OCCURRENCES_URL,
+        query_string={'from': window_start.strftime(DATETIME_FORMAT),
+                      'to': window_end.strftime(DATETIME_FORMAT)},
+        headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token)))
+
+    assert response.status_code == ResponseCodes.OK
+    expected = [dict(event_id=event_id,
+                     start=(payload['start'] + relativedelta(days=day))
+                     .strftime(DATETIME_FORMAT))
+                for day in (2, 3, 4)]
+    assert get_json(response, inner_data=True) == expected
+
+
+def test_iter_occurrences_starts_inside_window():
+    class PeriodicEvent(object):
+        start = datetime(2000, 1, 1, 12, tzinfo=pytz.utc)
+        end = None
+        periodic = True
+        period = timedelta(hours=7)
+
+    def occurrences(window_start, window_end):
+        return list(iter_occurrences(PeriodicEvent, window_start, window_end))
+
+    # 2017-06-01 04:00 is 21,808 periods after the start
+    expected = [datetime(2017, 6, 1, hour, tzinfo=pytz.utc)
+                for hour in (4, 11, 18)]
+    assert occurrences(datetime(2017, 6, 1, tzinfo=pytz.utc),
+                       datetime(2017, 6, 2, tzinfo=pytz.utc)) == expected
+    # the window includes an occurrence at its start, not one at its end
+    assert occurrences(datetime(2017, 6, 1, 4, tzinfo=pytz.utc),
+                       datetime(2017, 6, 2, 1, tzinfo=pytz.utc)) == expected
+    assert occurrences(datetime(2017, 6, 1, 4, 1, tzinfo=pytz.utc),
+                       datetime(2017, 6, 1, 11, tzinfo=pytz.utc)) == []
+
+
+def test_iter_occurrences_single_event_starts_inside_window():
+    class SingleEvent(object):
+        start = datetime(2017, 6, 1, 12, tzinfo=pytz.utc)
+        end = datetime(2017, 6, 3, 12, tzinfo=pytz.utc)
+        periodic = False
+        period = None
+
+    def occurrences(window_start, window_end):
+        return list(iter_occurrences(SingleEvent, window_start, window_end))
+
+    assert occurrences(datetime(2017, 6, 1, 12, tzinfo=pytz.utc),
+                       datetime(2017, 6, 2, tzinfo=pytz.utc)) == \
+        [SingleEvent.start]
+    # started before the window, ends inside it
+    assert occurrences(datetime(2017, 6, 2, tzinfo=pytz.utc),
+                       datetime(2017, 6, 4, tzinfo=pytz.utc)) == []
+    assert occurrences(datetime(2017, 6, 1, tzinfo=pytz.utc),
+                       datetime(2017, 6, 1, 12, tzinfo=pytz.utc)) == []
+
+
+def test_expand_reads_only_what_the_limit_needs():
+    class PeriodicEvent(object):
+        periodic = True
+        period = timedelta(hours=1)
+        end = None
+
+        def __init__(self, id, minute):
+            self.id = id
+            self.start = datetime(2017, 6, 1, 0, minute, tzinfo=pytz.utc)
+
+    events = [PeriodicEvent(id, minute=id) for id in range(10)]
+    window_start = datetime(2017, 6, 1, tzinfo=pytz.utc)
+    window_end = window_start + timedelta(days=365)
+
+    def starts(limit):
+        return [start for event, start in
+                expand(events, window_start, window_end, limit)]
+
+    expected = [datetime(2017, 6, 1, hour, minute, tzinfo=pytz.utc)
+                for hour in range(3) for minute in range(10)]
+    occurrence_cache.clear()
+    try:
+        assert starts(5) == expected[:5]
+        # besides the occurrences returned, merging reads at most one more
+        # per event
+        assert occurrence_cache.weight <= 5 + len(events)
+        assert starts(5) == expected[:5]
+        # cached prefixes are resumed where they stop
+        assert starts(30) == expected
+        assert occurrence_cache.weight <= 30 + len(events)
+    finally:
+        occurrence_cache.clear()
+
+
+def test_lru_cache_bounded_by_weight():
+    cache = LRUCache(maxsize=5, weigh=len)
+    cache.set('a', 'xx')
+    cache.set('b', 'xxx')
+    cache.set('c', 'x')
+    assert cache.get('a') is None and cache.weight == 4
+    cache.set('d', 'x' * 6)
+    assert cache.get('d') is None and cache.weight == 4
+    cache.set('b', 'x')
+    assert cache.weight == 2
+
+
+def test_dispatch_notifications(test_client, transaction, db_session):
+    user_payload, token = register_and_login_user(test_client)
+    periodic_payload = daily_event_payload(days=10)
+    single_payload = NonPeriodicEventFactory(
+        start=periodic_payload['end'] + relativedelta(days=1),
+        end=periodic_payload['end'] + relativedelta(days=2),
+        next_notification=periodic_payload['start'])
+    periodic_id = create_event(test_client, token,
+                               event_payload=periodic_payload)[1]['id']
+    single_id = create_event(test_client, token,
+                             event_payload=single_payload)[1]['id']
+
+    sink = InMemorySink()
+    now = periodic_payload['start'] + relativedelta(minutes=1)
+    assert dispatch_batch(sink, batch_size=10, now=now) == 2
+    assert dispatch_batch(sink, batch_size=10, now=now) == 0
+
+    assert sorted(n.event_id for n in sink.notifications) == \
+        sorted([periodic_id, single_id])
+    assert dict(db_session.query(Event.id, Event.version)) == \
+        {periodic_id: 2, single_id: 2}
+    next_notifications = dict(db_session.query(
+        Event.id, Event.next_notification))
+    assert next_notifications[single_id] is None
+    assert next_notifications[periodic_id] == \
+        periodic_payload['start'] + relativedelta(days=1)
+
+
+def test_sweep_passed_events(test_client, transaction, db_session):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(4, factory=NonPeriodicEventFactory)
+    for payload in payloads:
+        payload['status'] = 'W'
+    ids = [create_event(test_client, token, event_payload=payload)[1]['id']
+           for payload in payloads]
+
+    now = payloads[2]['end'] + relativedelta(minutes=1)
+    assert sweep_batch(batch_size=2, now=now) == 2
+    metrics = SweeperMetrics()
+    assert sweep(batch_size=2, now=now, metrics=metrics) == 1
+    assert metrics.to_json()['chunks'] == 1
+
+    statuses = {event_id: (status_registry.code_for(status_id), version)
+                for event_id, status_id, version in db_session.query(
+                    Event.id, Event.status_id, Event.version)}
+    assert [statuses[event_id] for event_id in ids] == \
+        [('P', 2), ('P', 2), ('P', 2), ('W', 1)]
+
+
+def test_dispatch_notifications_after_gap(test_client, transaction,
+                                          db_session):
+    user_payload, token = register_and_login_user(test_client)
+    payload = daily_event_payload(days=10)
+    event_id = create_event(test_client, token,
+                            event_payload=payload)[1]['id']
+
+    # the dispatcher was down for five days and a half
+    sink = InMemorySink()
+    now = payload['start'] + relativedelta(days=5, hours=12)
+    assert dispatch_batch(sink, batch_size=10, now=now) == 1
+    assert dispatch_batch(sink, batch_size=10, now=now) == 0
+
+    assert len(sink.notifications) == 1
+    next_notification, = db_session.query(Event.next_notification)\
+        .filter(Event.id == event_id).one()
+    assert next_notification == payload['start'] + relativedelta(days=6)
+
+    # past the last reminder of the series, it is not reminded any more
+    now = payload['start'] + relativedelta(days=20)
+    assert dispatch_batch(sink, batch_size=10, now=now) == 1
+    next_notification, = db_session.query(Event.next_notification)\
+        .filter(Event.id == event_id).one()
+    assert next_notification is None
+
+
+def test_status_registry(transaction, db_session):
+    rows = db_session.query(EventStatus.id, EventStatus.status).all()
+    assert rows
+
+    with count_statements() as statements:
+        for status_id, status in rows:
+            assert status_registry.id_for(status.code) == status_id
+            assert status_registry.code_for(status_id) == status.code
+    assert not statements.count
+
+    with pytest.raises(UnknownStatus):
+        status_registry.id_for('X')
+
+
+def test_create_events_reuses_labels(test_client, transaction, db_session):
+    user_payload, token = register_and_login_user(test_client)
+    first, second = sequential_event_payloads(2)
+    first['labels'] = ['work', 'home']
+    second['labels'] = ['home', 'gym']
+
+    for payload in (first, second):
+        dumped_payload, data = create_event(test_client, token,
+                                            event_payload=payload)
+        assert Counter(data['labels']) == Counter(payload['labels'])
+
+    names = [name for name, in db_session.query(Label.name)]
+    assert Counter(names) == Counter(['work', 'home', 'gym'])
+
+
+def test_create_event_label_statements(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    few, many = sequential_event_payloads(2)
+    few['labels'] = ['label']
+    many['labels'] = ['label_{}'.format(i) for i in range(20)]
+
+    query_counts = []
+    for payload in (few, many):
+        with count_statements() as statements:
+            create_event(test_client, token, event_payload=payload)
+        query_counts.append(statements.count)
+
+    assert query_counts[0] == query_counts[1]
+
+
+def test_bulk_create_events(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    existing, valid, clashing, first_pair, second_pair, invalid = \
+        sequential_event_payloads(6, factory=EventPayloadFactory)
+    create_event(test_client, token, event_payload=existing)
+    clashing.update(start=existing['start'], end=existing['end'])
+    second_pair['start'] = first_pair['start'] + relativedelta(minutes=30)
+    invalid['end'] = invalid['start'] - relativedelta(minutes=5)
+
+    payloads = [valid, clashing, first_pair, second_pair, invalid]
+    response = test_client.post(
+        BULK_CREATE_URL,
+        data=json.dumps(EventPayloadSchema(many=True).dump(payloads).data),
+        headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token)))
+
+    assert response.status_code == ResponseCodes.CREATED
+    results = get_json(response, inner_data=True)
+    assert [result['index'] for result in results] == list(range(5))
+    assert 'id' in results[0]
+    for result in results[1:4]:
+        assert result['errors'] == {
+            '_schema': ['Event is overlapping with others']}
+    assert 'start' in results[4]['errors']
+
+    response = test_client.get(get_detail_url(results[0]['id']),
+                               headers=dict(JSON_CONTENT_TYPE,
+                                            **get_auth_header(token)))
+    assert dict_contains_subset(
+        EventPayloadSchema().dump(valid).data,
+        get_json(response, inner_data=True))
+
+
+def test_bulk_create_rejects_non_list(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    response = test_client.post(
+        BULK_CREATE_URL,
+        data=json.dumps({}),
+        headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token)))
+
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+
+def test_bulk_create_rejects_malformed_items(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    valid, missing_start, bad_start = \
+        EventPayloadSchema(many=True).dump(
+            sequential_event_payloads(3, factory=EventPayloadFactory)).data
+    del missing_start['start']
+    bad_start['start'] = 'garbage'
+
+    payloads = [valid, missing_start, bad_start, 'x', [1], None]
+    response = test_client.post(
+        BULK_CREATE_URL,
+        data=json.dumps(payloads),
+        headers=dict(JSON_CONTENT_TYPE, **get_auth_header(token)))
+
+    assert response.status_code == ResponseCodes.CREATED
+    results = get_json(response, inner_data=True)
+    assert 'id' in results[0]
+    assert list(results[1]['errors']) == ['start']
+    assert list(results[2]['errors']) == ['start']
+    for result in results[3:]:
+        assert result['errors'] == {'_schema': ['Invalid event']}
+
+
+def test_find_overlaps_matches_pairwise_check():
+    for attempt in range(200):
+        intervals = []
+        for key in range(randint(0, 8)):
+            start = randint(0, 50)
+            intervals.append(Interval(start, start + randint(0, 10),
+                                      key if randint(0, 3) else None))
+
+        expected = {
+            interval.key for interval in intervals
+            if interval.key is not None and any(
+                max(interval.start, other.start) <=
+                min(interval.end, other.end)
+                for other in intervals if other is not interval)
+        }
+        assert find_overlaps(intervals) == expected
+
+
+def import_events(test_client, token, body, content_type):
+    response = test_client.post(IMPORT_URL,
+                                data=body,
+                                content_type=content_type,
+                                headers=get_auth_header(token))
+    return response, get_json(response, inner_data=True)
+
+
+def test_import_events_ndjson(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    existing, valid, clashing, overlapped, invalid = \
+        sequential_event_payloads(5, factory=EventPayloadFactory)
+    create_event(test_client, token, event_payload=existing)
+    clashing.update(start=existing['start'], end=existing['end'])
+    overlapped['start'] = valid['start']
+    invalid['end'] = invalid['start'] - relativedelta(minutes=5)
+
+    lines = [json.dumps(EventPayloadSchema().dump(payload).data)
+             for payload in (valid, clashing, overlapped, invalid)]
+    lines.insert(1, 'not json')
+    response, report = import_events(test_client, token, '\n'.join(lines),
+                                     'application/x-ndjson')
+
+    assert response.status_code == ResponseCodes.CREATED
+    assert (report['read'], report['imported'], report['rejected']) == \
+        (5, 1, 4)
+    assert [error['line'] for error in report['errors']] == [2, 3, 4, 5]
+
+    response, body = get_list(test_client, token)
+    imported = body['data'][1]
+    assert dict_contains_subset(EventPayloadSchema().dump(valid).data,
+                                imported)
+
+
+def test_import_events_rejected_rows_do_not_reject_others(test_client,
+                                                          transaction):
+    user_payload, token = register_and_login_user(test_client)
+    start = get_timezone_aware_time() + relativedelta(days=1)
+    payloads = [NonPeriodicEventFactory(start=start + relativedelta(hours=a),
+                                        end=start + relativedelta(hours=b))
+                for a, b in ((1, 3), (2, 20), (10, 11))]
+    lines = [json.dumps(EventPayloadSchema().dump(payload).data)
+             for payload in payloads]
+    response, report = import_events(test_client, token, '\n'.join(lines),
+                                     'application/x-ndjson')
+
+    assert response.status_code == ResponseCodes.CREATED
+    assert (report['imported'], report['rejected']) == (2, 1)
+    assert [error['line'] for error in report['errors']] == [2]
+
+
+def test_import_events_all_rejected(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    response, report = import_events(test_client, token, 'not json',
+                                     'application/x-ndjson')
+
+    assert response.status_code == ResponseCodes.UNPROCESSABLE_ENTITY_422
+    assert (report['read'], report['imported']) == (1, 0)
+
+
+def test_import_events_csv(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    payloads = sequential_event_payloads(3, factory=EventPayloadFactory)
+    payloads[0]['labels'] = ['work', 'home']
+
+    rows = ['description,start,end,periodic,status,labels']
+    for payload in payloads:
+        dumped = EventPayloadSchema().dump(payload).data
+        rows.append(','.join([dumped['description'], dumped['start'],
+                              dumped['end'], 'false', dumped['status'],
+                              ';'.join(dumped['labels'])]))
+    response, report = import_events(test_client, token, '\n'.join(rows),
+                                     'text/csv')
+
+    assert response.status_code == ResponseCodes.CREATED
+    assert report['imported'] == 3
+    response, body = get_list(test_client, token)
+    assert Counter(body['data'][0]['labels']) == Counter(['work', 'home'])
+
+
+def test_import_events_rejects_rows_without_start(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    valid, missing, bad, empty, last = EventPayloadSchema(many=True).dump(
+        sequential_event_payloads(5, factory=EventPayloadFactory)).data
+    del missing['start']
+    bad['start'] = 'garbage'
+    lines = [json.dumps(payload) for payload in (valid, missing, bad)]
+    response, report = import_events(test_client, token, '\n'.join(lines),
+                                     'application/x-ndjson')
+
+    assert response.status_code == ResponseCodes.CREATED
+    assert (report['read'], report['imported'], report['rejected']) == \
+        (3, 1, 2)
+    assert [(error['line'], list(error['errors']))
+            for error in report['errors']] == [(2, ['start']), (3, ['start'])]
+
+    rows = ['description,start,end,periodic,status']
+    for payload in (empty, last):
+        rows.append(','.join([payload['description'], payload['start'],
+                              payload['end'], 'false', payload['status']]))
+    rows[1] = rows[1].replace(empty['start'], '')
+    response, report = import_events(test_client, token, '\n'.join(rows),
+                                     'text/csv')
+
+    assert response.status_code == ResponseCodes.CREATED
+    assert (report['imported'], report['rejected']) == (1, 1)
+    assert [(error['line'], list(error['errors']))
+            for error in report['errors']] == [(2, ['start'])]
+    response, body = get_list(test_client, token)
+    assert len(body['data']) == 2
+
+
+def export_events(test_client, token, headers=None, **params):
+    return test_client.get(EXPORT_URL,
+                           query_string=params,
+                           headers=dict(headers or {},
+                                        **get_auth_header(token)))
+
+
+def test_export_events_ndjson(test_client, transaction, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_STREAM_CHUNK_SIZE', 2)
+    user_payload, token = register_and_login_user(test_client)
+    for payload in sequential_event_payloads(3, factory=EventPayloadFactory):
+        create_event(test_client, token, event_payload=payload)
+
+    response = export_events(test_client, token)
+    assert response.status_code == ResponseCodes.OK
+    assert response.mimetype == 'application/x-ndjson'
+    exported = [json.loads(line) for line in
+                str(response.data, encoding='utf-8').splitlines()]
+    response, body = get_list(test_client, token)
+    for event in exported + body['data']:
+        event['labels'] = sorted(event['labels'])
+    assert exported == body['data']
+
+
+def test_export_events_ical(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    start = datetime(2030, 1, 1, 9, tzinfo=pytz.utc)
+    payload = PeriodicEventPayloadFactory(
+        start=start, end=start + relativedelta(weeks=10),
+        period=timedelta(weeks=2),
+        description='standup, daily; again')
+    create_event(test_client, token, event_payload=payload)
+
+    response = export_events(test_client, token, format='ics')
+    assert response.status_code == ResponseCodes.OK
+    assert response.mimetype == 'text/calendar'
+    lines = str(response.data, encoding='utf-8').split('\r\n')
+    assert lines[0] == 'BEGIN:VCALENDAR'
+    assert 'DTSTART:20300101T090000Z' in lines
+    assert 'RRULE:FREQ=WEEKLY;INTERVAL=2;UNTIL=20300312T090000Z' in lines
+    assert 'SUMMARY:standup\\, daily\\; again' in lines
+    assert not any(line.startswith('DTEND') for line in lines)
+
+
+def test_export_events_gzip(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    for payload in sequential_event_payloads(2, factory=EventPayloadFactory):
+        create_event(test_client, token, event_payload=payload)
+
+    plain = export_events(test_client, token)
+    response = export_events(test_client, token,
+                             headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_export_events_invalid_format(test_client, transaction):
+    user_payload, token = register_and_login_user(test_client)
+    response = export_events(test_client, token, format='xml')
+    assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+
+def test_ical_fold():
+    line = 'DESCRIPTION:' + 'é' * 100
+    folded = fold(line)
+    parts = folded[:-2].split('\r\n ')
+    assert all(len(part.encode('utf-8')) <= 75 for part in parts)
+    assert ''.join(parts) == line
+
+
+def test_compiled_event_dump_parity():
+    status_registry.load([(1, 'W'), (2, 'P')])
+    user = User(username='parity', email='parity@example.com',
+                first_name='Pär', last_name=None)
+    start = datetime(2030, 1, 1, 9, 30, tzinfo=pytz.utc)
+    events = [
+        Event(id=1, user=user, description='plain', start=start,
+              end=start + timedelta(hours=1), periodic=False, status_id=1,
+              labels=[], media=[]),
+        Event(id=2, user=user, description=None, place='home', start=start,
+              end=start + relativedelta(months=3), periodic=True,
+              period=timedelta(days=7, seconds=5), status_id=2,
+              next_notification=start + timedelta(days=7),
+              labels=[Label(name='work'), Label(name='ünï')],
+              media=[EventMedia(), EventMedia()]),
+        Event(id=3, user=None, start=start, end=start, periodic=None,
+              status_id=None, labels=[], media=[]),
+    ]
+    try:
+        schema = EventSchema()
+        for event in events:
+            assert json.dumps(dump_event(event)) == \
+                json.dumps(schema.dump(event).data)
+        assert json.dumps(dump_events(events)) == \
+            json.dumps(schema.dump(events, many=True).data)
+    finally:
+        status_registry.clear()
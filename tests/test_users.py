@@ -1,9 +1,26 @@
 import json
+import logging
+import os
+import subprocess
+import sys
 
 import jwt
-from flask import url_for
-from common import app
+import pytest
+import pytz
+from flask import Response, url_for
+from app import app
+from common import datetimes, json_encoding, metrics
+from common.extensions import db
 
+from common.jwt_functions import identity_cache
+from events.statuses import status_registry
+from common.models import User
+from common.database import db_session, engine_from_config, get_engine
+from common.warmup import warmup
+from common.sqlstats import (
+    QueryBudgetExceeded, count_statements, parameter_shapes, query_budget,
+    slow_query_logger
+)
 from common.utils import ResponseCodes, get_json
 
 from datetime import datetime, timedelta
@@ -108,3 +125,241 @@ def test_invalid_register_payload(test_client, transaction):
                                 data=json.dumps(user_payload),
                                 **JSON_CONTENT_TYPE)
     assert response.status_code == ResponseCodes.BAD_REQUEST_400
+
+
+def test_identity_is_cached(test_client, transaction):
+    user_payload, token, user_id = register_and_login_user(test_client,
+                                                           with_id=True)
+
+    query_counts = []
+    for attempt in range(2):
+        with count_statements() as statements:
+            response = test_client.get(user_detail_url(user_id=user_id),
+                                       headers=get_auth_header(token))
+        assert response.status_code == ResponseCodes.OK
+        query_counts.append(statements.count)
+
+    assert query_counts[1] == query_counts[0] - 1
+    assert identity_cache.get(user_id).username == user_payload['username']
+
+
+def test_identity_cache_invalidated_on_update(test_client, transaction,
+                                              db_session):
+    user_payload, token, user_id = register_and_login_user(test_client,
+                                                           with_id=True)
+    test_client.get(user_detail_url(user_id=user_id),
+                    headers=get_auth_header(token))
+
+    user = db_session.query(User).get(user_id)
+    user.first_name = 'Renamed'
+    db_session.commit()
+
+    assert identity_cache.get(user_id) is None
+
+
+def test_identity_cache_disabled(test_client, transaction, monkeypatch):
+    monkeypatch.setitem(app.config, 'JWT_IDENTITY_CACHE', False)
+    user_payload, token, user_id = register_and_login_user(test_client,
+                                                           with_id=True)
+
+    response = test_client.get(user_detail_url(user_id=user_id),
+                               headers=get_auth_header(token))
+    assert response.status_code == ResponseCodes.OK
+    assert identity_cache.get(user_id) is None
+
+
+def test_query_budget(transaction, monkeypatch):
+    @query_budget(1)
+    def two_statements():
+        db_session.execute('SELECT 1')
+        db_session.execute('SELECT 2')
+
+    with app.test_request_context():
+        with pytest.raises(QueryBudgetExceeded):
+            two_statements()
+
+        monkeypatch.setitem(app.config, 'QUERY_BUDGET_STRICT', False)
+        two_statements()
+
+
+def test_query_budget_covers_streamed_body(transaction):
+    def chunks(statements_per_chunk):
+        for chunk in range(2):
+            for _ in range(statements_per_chunk):
+                db_session.execute('SELECT 1')
+            yield b'chunk'
+
+    def streaming_view(statements_per_chunk):
+        return Response(chunks(statements_per_chunk))
+
+    with app.test_request_context():
+        # checks the connection out before anything is counted
+        db_session.execute('SELECT 1')
+        within = query_budget(0, per_chunk=1)(streaming_view)(1)
+        assert list(within.response) == [b'chunk', b'chunk']
+
+        over = query_budget(0, per_chunk=1)(streaming_view)(2)
+        with pytest.raises(QueryBudgetExceeded):
+            list(over.response)
+
+
+def test_single_engine(db_session):
+    engine = get_engine()
+    assert db.engine is engine
+    assert db_session.get_bind() is engine
+    assert 'db_pool' in metrics.snapshot()
+
+
+def test_pool_replaces_dead_connections(db_session):
+    pool_engine = engine_from_config(dict(app.config,
+                                          SQLALCHEMY_ECHO=False,
+                                          SQLALCHEMY_POOL_SIZE=1,
+                                          SQLALCHEMY_MAX_OVERFLOW=0))
+    try:
+        pid = pool_engine.scalar('SELECT pg_backend_pid()')
+        with get_engine().connect() as connection:
+            connection.execute('SELECT pg_terminate_backend(%s)', pid)
+
+        assert pool_engine.scalar('SELECT pg_backend_pid()') != pid
+        assert pool_engine.scalar("SELECT setting FROM pg_settings "
+                                  "WHERE name = 'statement_timeout'") == \
+            str(app.config['SQLALCHEMY_STATEMENT_TIMEOUT'])
+        stats = pool_engine.pool.stats()
+        assert (stats['size'], stats['checked_out']) == (1, 0)
+        assert stats['checkouts'] >= 3
+    finally:
+        pool_engine.dispose()
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_request_sql_timing(test_client, transaction, monkeypatch):
+    user_payload, token = register_and_login_user(test_client)
+    user_id = jwt.decode(token, verify=False)['identity']
+    monkeypatch.setitem(app.config, 'SQL_SLOW_QUERY_THRESHOLD', 0)
+    handler = RecordingHandler()
+    slow_query_logger.addHandler(handler)
+    try:
+        response = test_client.get(user_detail_url(user_id),
+                                   headers=get_auth_header(token))
+    finally:
+        slow_query_logger.removeHandler(handler)
+
+    assert response.status_code == ResponseCodes.OK
+    slow = [json.loads(message) for message in handler.messages]
+    assert response.headers['Server-Timing'].startswith(
+        'db;desc="{} statements";dur='.format(len(slow)))
+    assert slow and all(entry['endpoint'] == 'users.detail'
+                        for entry in slow)
+    assert set(slow[-1]['parameters'].values()) == {'int'}
+
+
+def test_parameter_shapes():
+    assert parameter_shapes({'id': 1, 'names': ['a', 'b']}) == \
+        {'id': 'int', 'names': 'list[2]'}
+    assert parameter_shapes(('a', None)) == ['str', 'NoneType']
+    assert parameter_shapes([{'id': 1}, {'id': 2}], executemany=True) == \
+        "2 x {'id': 'int'}"
+
+
+IMPORT_CHECK = """
+import sys
+import {module}
+print(' '.join(name for name in ('flask', 'sqlalchemy', 'events')
+               if name in sys.modules))
+import common.database
+print(common.database._engine is None)
+"""
+
+
+def import_in_subprocess(module, **env):
+    environ = dict(os.environ, **env)
+    environ.pop('RUN_MODE', None)
+    environ.update(env)
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CHECK.format(module=module)],
+        env=environ, stderr=subprocess.DEVNULL, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    loaded, no_engine = output.split('\n')[:2]
+    return no_engine == 'True', loaded.split()
+
+
+def test_common_import_has_no_side_effects():
+    # neither flask nor sqlalchemy loaded: no app and no engine is built
+    no_engine, loaded = import_in_subprocess('common')
+    assert no_engine
+    assert loaded == []
+
+
+def test_app_import_creates_no_engine():
+    no_engine, loaded = import_in_subprocess('app', RUN_MODE='TEST')
+    assert no_engine
+    assert 'events' in loaded
+
+
+def test_warmup(transaction):
+    status_registry.clear()
+    warmup(app)
+    assert status_registry.code_for(status_registry.id_for('W')) == 'W'
+    assert get_engine().pool.checkedin() >= \
+        app.config['SQLALCHEMY_POOL_SIZE']
+
+
+def test_forked_process_gets_own_engine(db_session):
+    engine = get_engine()
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if get_engine() is not engine else 1)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert get_engine() is engine
+    assert engine.scalar('SELECT 1') == 1
+
+
+def test_json_encoders():
+    data = {
+        'text': 'ünï "quoted"',
+        'when': datetime(2030, 1, 2, 3, 4, 5, tzinfo=pytz.utc),
+        'every': timedelta(days=1, hours=2, seconds=3),
+        'items': [1, 2.5, None, True],
+        1: 'int key',
+    }
+    expected = {
+        'text': 'ünï "quoted"',
+        'when': '2030-01-02 03:04:05 +0000',
+        'every': '1 2:0:3',
+        'items': [1, 2.5, None, True],
+        '1': 'int key',
+    }
+    assert json.loads(json_encoding.stdlib_dumps(data).decode('utf-8')) == \
+        expected
+    assert json_encoding.loads(json_encoding.dumps(data)) == expected
+
+
+def test_datetime_format_from_config():
+    from events.serializers import EventSchema
+    when = datetime(2030, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+    try:
+        datetimes.configure({'DATETIME_FORMAT': '%Y-%m-%dT%H:%M:%S%z'})
+        assert json_encoding.loads(json_encoding.dumps({'when': when})) == \
+            {'when': '2030-01-02T03:04:05+0000'}
+        assert EventSchema().fields['start'].deserialize(
+            '2030-01-02T03:04:05+0000') == when
+    finally:
+        datetimes.configure(app.config)
+
+
+def test_pre_encoded_response():
+    body = json_encoding.PreEncoded(b'{"data":[]}')
+    with app.test_request_context():
+        response = json_encoding.output_json(body, ResponseCodes.OK,
+                                             headers={'X-Test': '1'})
+    assert response.data == body
+    assert response.headers['X-Test'] == '1'